@@ -1,20 +1,45 @@
-from flask import Flask, render_template, jsonify, request, redirect, url_for, make_response
+from flask import Flask, Request, render_template, jsonify, request, redirect, url_for, make_response, g, has_request_context, Response, stream_with_context
 import os
+import time
+import threading
+from collections import OrderedDict, deque, namedtuple
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED, TimeoutError as FutureTimeoutError
 import uuid
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
 import logging
 import sys
 import json
+import tempfile
+import importlib
+import zlib
+import base64
+import csv
+import io
 import traceback
 import re
 import requests # For OpenRouter
+from requests.adapters import HTTPAdapter
 # from dotenv import load_dotenv # Not needed on Vercel
 import secrets
+import hashlib
 
 # For Redis
 import redis
+from redis.backoff import ExponentialBackoff
+from redis.retry import Retry
 from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.exceptions import RequestEntityTooLarge
+from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
 from functools import wraps
+from abc import ABC, abstractmethod
+import click
+
+try:
+    import msgpack  # Optional: compact binary encoding for stored notes
+except ImportError:
+    msgpack = None
 
 # Configure logging
 logging.basicConfig(
@@ -35,100 +60,428 @@ app = Flask(__name__,
 
 # Configure secret key
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', os.urandom(24))
+if 'SECRET_KEY' not in os.environ:
+    logger.warning("SECRET_KEY not set; auth tokens will not survive restarts or verify across workers")
+
+# Redis connection setup
+class InstrumentedConnectionPool(redis.BlockingConnectionPool):
+    """Blocking connection pool that records utilisation and checkout wait times."""
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self._checked_out = set()
+        self.stats = {'checkouts': 0, 'checkout_errors': 0, 'wait_seconds_total': 0.0, 'wait_seconds_max': 0.0}
+    
+    def get_connection(self, command_name, *keys, **options):
+        started = time.perf_counter()
+        try:
+            connection = super().get_connection(command_name, *keys, **options)
+        except Exception:
+            with self._stats_lock:
+                self.stats['checkout_errors'] += 1
+            raise
+        waited = time.perf_counter() - started
+        with self._stats_lock:
+            self._checked_out.add(id(connection))
+            self.stats['checkouts'] += 1
+            self.stats['wait_seconds_total'] += waited
+            self.stats['wait_seconds_max'] = max(self.stats['wait_seconds_max'], waited)
+        return connection
+    
+    def release(self, connection):
+        with self._stats_lock:
+            self._checked_out.discard(id(connection))
+        super().release(connection)
+    
+    def get_stats(self):
+        with self._stats_lock:
+            stats = dict(self.stats)
+            in_use = len(self._checked_out)
+        stats.update({
+            'max_connections': self.max_connections,
+            'created_connections': len(self._connections),
+            'in_use': in_use,
+            'utilisation': in_use / self.max_connections if self.max_connections else 0,
+            'wait_seconds_avg': stats['wait_seconds_total'] / stats['checkouts'] if stats['checkouts'] else 0.0,
+        })
+        return stats
+
+def create_redis_client(url):
+    """Create a Redis client backed by an instrumented, health-checked connection pool.
+    
+    No connection is opened until the first command is issued. Pool size,
+    timeouts and retries are configured through REDIS_* environment variables.
+    """
+    retry_attempts = int(os.environ.get('REDIS_RETRY_ATTEMPTS', 3))
+    pool = InstrumentedConnectionPool.from_url(
+        url,
+        max_connections=int(os.environ.get('REDIS_MAX_CONNECTIONS', 20)),
+        timeout=float(os.environ.get('REDIS_POOL_TIMEOUT', 5)),
+        socket_timeout=float(os.environ.get('REDIS_SOCKET_TIMEOUT', 5)),
+        socket_connect_timeout=float(os.environ.get('REDIS_CONNECT_TIMEOUT', 3)),
+        socket_keepalive=True,
+        health_check_interval=int(os.environ.get('REDIS_HEALTH_CHECK_INTERVAL', 30)),
+        retry_on_timeout=True,
+        retry=Retry(ExponentialBackoff(cap=1, base=0.05), retry_attempts),
+    )
+    return redis.Redis(connection_pool=pool)
 
-# Simplified Redis connection setup
 redis_client = None
 redis_url = os.environ.get('REDIS_URL')
 
 if redis_url:
     try:
-        logger.info("Attempting to connect to Redis...")
-        redis_client = redis.Redis.from_url(redis_url)
-        redis_client.ping()  # Test connection
-        logger.info("Successfully connected to Redis")
+        redis_client = create_redis_client(redis_url)
+        logger.info("Configured Redis client; connecting on first use")
     except Exception as e:
-        logger.error(f"Failed to connect to Redis: {str(e)}")
+        logger.error(f"Failed to configure Redis client: {str(e)}")
         redis_client = None
 else:
     logger.warning("REDIS_URL not found in environment variables")
 
-# Custom session management instead of Flask-Session
-def get_session_id():
-    """Get or create session ID from cookies"""
-    session_id = request.cookies.get('session_id')
-    if not session_id:
-        session_id = str(uuid.uuid4())
-    return session_id
-
-def get_session_data(session_id):
-    """Get session data from Redis or return empty dict"""
-    if not redis_client:
-        return {}
-    try:
-        session_data = redis_client.get(f"session:{session_id}")
-        if session_data:
-            return json.loads(session_data)
-    except Exception as e:
-        logger.error(f"Error getting session data: {str(e)}")
-    return {}
+def get_redis_pool_stats():
+    pool = redis_client.connection_pool if redis_client else None
+    if not isinstance(pool, InstrumentedConnectionPool):
+        return None
+    return pool.get_stats()
 
-def save_session_data(session_id, data):
-    """Save session data to Redis"""
-    if not redis_client:
-        return False
-    try:
-        redis_client.set(f"session:{session_id}", json.dumps(data), ex=86400)  # 24 hour expiry
-        return True
-    except Exception as e:
-        logger.error(f"Error saving session data: {str(e)}")
-        return False
+# Custom session management instead of Flask-Session
+# Sessions are Redis hashes with one JSON-encoded field per key, loaded at most
+# once per request. Only the keys a request changed are written back (after the
+# response is built), so concurrent tabs updating different keys do not
+# overwrite each other, and the expiry slides forward without rewriting the
+# payload. Sessions stored by older versions as a single JSON string are still
+# read and are converted to a hash the first time they are written.
+SESSION_COOKIE_NAME = 'session_id'
+SESSION_TTL = 86400  # 24 hours, refreshed on every request that uses the session
+
+class RequestSession:
+    """Dict-like view of one session that loads on first use and tracks changed keys."""
+    
+    def __init__(self, session_id, is_new=False):
+        self.session_id = session_id
+        self.key = f"session:{session_id}"
+        self.is_new = is_new
+        self._data = None
+        self._legacy = False
+        self._dirty = set()
+        self._deleted = set()
+    
+    @property
+    def data(self):
+        if self._data is None:
+            self._data = {} if self.is_new else self._load()
+        return self._data
+    
+    def _load(self):
+        if not redis_client:
+            return {}
+        try:
+            try:
+                fields = redis_client.hgetall(self.key)
+            except redis.exceptions.ResponseError:
+                # WRONGTYPE: a session saved as one JSON string by an older version
+                raw = redis_client.get(self.key)
+                self._legacy = True
+                return json.loads(raw) if raw else {}
+            return {decode_redis_value(field): json.loads(value) for field, value in fields.items()}
+        except Exception as e:
+            logger.error(f"Error getting session data: {str(e)}")
+            return {}
+    
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+    
+    def __getitem__(self, key):
+        return self.data[key]
+    
+    def __contains__(self, key):
+        return key in self.data
+    
+    def __setitem__(self, key, value):
+        self.data[key] = value
+        self._dirty.add(key)
+        self._deleted.discard(key)
+    
+    def update(self, values):
+        for key, value in values.items():
+            self[key] = value
+    
+    def setdefault(self, key, default=None):
+        if key not in self.data:
+            self[key] = default
+        return self.data[key]
+    
+    def pop(self, key, default=None):
+        if key not in self.data:
+            return default
+        self._dirty.discard(key)
+        self._deleted.add(key)
+        return self.data.pop(key)
+    
+    def mark_dirty(self, key):
+        """Flag a key whose value was mutated in place so it is written back."""
+        if key in self.data:
+            self._dirty.add(key)
+    
+    @property
+    def loaded(self):
+        return self._data is not None
+    
+    def save(self):
+        """Write changed keys back and slide the expiry; returns True if the session is stored."""
+        if not redis_client or self._data is None:
+            return False
+        if not self._data and not self._deleted:
+            return False  # Nothing stored and nothing to remove
+        try:
+            pipe = redis_client.pipeline(transaction=True)
+            if self._legacy:
+                # Replace the JSON string with a hash holding the whole session
+                pipe.delete(self.key)
+                dirty = set(self._data)
+            else:
+                dirty = self._dirty
+            if dirty:
+                pipe.hset(self.key, mapping={key: json.dumps(self._data[key]) for key in dirty})
+            if self._deleted and not self._legacy:
+                pipe.hdel(self.key, *self._deleted)
+            pipe.expire(self.key, SESSION_TTL)
+            pipe.execute()
+        except Exception as e:
+            logger.error(f"Error saving session data: {str(e)}")
+            return False
+        self._legacy = False
+        self._dirty.clear()
+        self._deleted.clear()
+        return bool(self._data)
 
 def get_session():
-    """Get current session data"""
-    session_id = get_session_id()
-    return get_session_data(session_id)
+    """Get the current request's session, loading it from Redis on first use."""
+    if 'session_store' not in g:
+        session_id = request.cookies.get(SESSION_COOKIE_NAME)
+        g.session_store = RequestSession(session_id or str(uuid.uuid4()), is_new=not session_id)
+    return g.session_store
 
 def update_session(data):
-    """Update session data and ensure cookie is set"""
-    session_id = get_session_id()
-    current_data = get_session_data(session_id)
-    current_data.update(data)
-    if save_session_data(session_id, current_data):
-        # Set session cookie in response if not already set
-        if not request.cookies.get('session_id'):
-            response = make_response()
-            response.set_cookie('session_id', session_id, max_age=86400, httponly=True)
-            return session_id, response
-    return session_id, None
+    """Merge keys into the current session; they are written back once the response is ready."""
+    session = get_session()
+    session.update(data)
+    return session.session_id, None
+
+@app.after_request
+def save_request_session(response):
+    session = g.get('session_store')
+    if session is not None and session.save():
+        # Slide the cookie along with the Redis expiry
+        response.set_cookie(SESSION_COOKIE_NAME, session.session_id, max_age=SESSION_TTL, httponly=True)
+    return response
 
 # OpenRouter API Key
 OPENROUTER_API_KEY = os.environ.get('OPENROUTER_API_KEY')
 if not OPENROUTER_API_KEY:
     logger.warning("OPENROUTER_API_KEY not found in environment variables")
 
+# Signed auth tokens
+# The auth_token cookie carries the dentist ID and a token ID (jti), signed with
+# SECRET_KEY, so requests are authenticated without a Redis lookup. Logged-out
+# tokens are listed in a sorted set scored by expiry, which each process
+# reloads at most every AUTH_DENYLIST_REFRESH seconds.
+AUTH_COOKIE_NAME = 'auth_token'
+AUTH_TOKEN_MAX_AGE = 86400 * 30  # 30 days
+AUTH_DENYLIST_KEY = 'auth:revoked_tokens'
+AUTH_DENYLIST_REFRESH = float(os.environ.get('AUTH_DENYLIST_REFRESH', 30))
+
+auth_serializer = URLSafeTimedSerializer(app.config['SECRET_KEY'], salt='auth-token')
+revoked_tokens = {'jtis': set(), 'loaded_at': 0.0, 'refreshing': False}
+revoked_tokens_lock = threading.Lock()  # Guards the dict only; never held during Redis calls
+
+def issue_auth_token(dentist_id):
+    return auth_serializer.dumps({'dentist_id': dentist_id, 'jti': secrets.token_urlsafe(12)})
+
+def set_auth_cookie(response, dentist_id):
+    response.set_cookie(AUTH_COOKIE_NAME, issue_auth_token(dentist_id), max_age=AUTH_TOKEN_MAX_AGE,
+                        httponly=True, samesite='Lax')
+    return response
+
+def load_auth_token(token):
+    """Return the token payload if the signature is valid and unexpired, otherwise None."""
+    try:
+        payload = auth_serializer.loads(token, max_age=AUTH_TOKEN_MAX_AGE)
+    except (BadSignature, SignatureExpired):
+        return None
+    if not isinstance(payload, dict) or not payload.get('dentist_id'):
+        return None
+    return payload
+
+def is_token_revoked(jti):
+    # One thread reloads a stale denylist; the others keep checking the current set meanwhile
+    with revoked_tokens_lock:
+        refresh = (redis_client is not None and not revoked_tokens['refreshing']
+                   and time.monotonic() - revoked_tokens['loaded_at'] > AUTH_DENYLIST_REFRESH)
+        if refresh:
+            revoked_tokens['refreshing'] = True
+            previous = set(revoked_tokens['jtis'])
+    if refresh:
+        jtis = None
+        try:
+            jtis = {decode_redis_value(j) for j in redis_client.zrangebyscore(AUTH_DENYLIST_KEY, time.time(), '+inf')}
+        except Exception as e:
+            logger.error(f"Error loading revoked auth tokens: {str(e)}")
+        finally:
+            with revoked_tokens_lock:
+                if jtis is not None:
+                    # Keep tokens this process revoked while the reload was in flight
+                    revoked_tokens['jtis'] = jtis | (revoked_tokens['jtis'] - previous)
+                revoked_tokens['loaded_at'] = time.monotonic()
+                revoked_tokens['refreshing'] = False
+    with revoked_tokens_lock:
+        return jti in revoked_tokens['jtis']
+
+def revoke_auth_token(token):
+    payload = load_auth_token(token)
+    if not payload:
+        return
+    jti = payload.get('jti')
+    with revoked_tokens_lock:
+        revoked_tokens['jtis'].add(jti)
+    if redis_client:
+        try:
+            now = time.time()
+            pipe = redis_client.pipeline()
+            pipe.zadd(AUTH_DENYLIST_KEY, {jti: now + AUTH_TOKEN_MAX_AGE})
+            pipe.zremrangebyscore(AUTH_DENYLIST_KEY, '-inf', now)
+            pipe.execute()
+        except Exception as e:
+            logger.error(f"Error revoking auth token: {str(e)}")
+
+def get_current_dentist_id():
+    """Return the dentist ID from a valid, unrevoked auth token cookie, or None."""
+    if 'dentist_id' not in g:
+        g.dentist_id = None
+        token = request.cookies.get(AUTH_COOKIE_NAME)
+        payload = load_auth_token(token) if token else None
+        if payload and not is_token_revoked(payload.get('jti')):
+            g.dentist_id = payload['dentist_id']
+    return g.dentist_id
+
 # Authentication decorator
 def login_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        dentist_id = request.cookies.get('dentist_id')
-        if not dentist_id or not get_dentist_from_kv(dentist_id):
+        if not get_current_dentist_id():
+            return redirect(url_for('login'))
+        return f(*args, **kwargs)
+    return decorated_function
+
+class TTLCache:
+    """Small thread-safe LRU cache whose entries expire after `ttl` seconds."""
+    
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+    
+    def set(self, key, value):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+    
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+    
+    def __len__(self):
+        return len(self._entries)
+
+# Admin access is limited to dentists whose email is listed in ADMIN_EMAILS
+ADMIN_EMAILS = {email.strip().lower() for email in os.environ.get('ADMIN_EMAILS', '').split(',') if email.strip()}
+
+def admin_required(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        dentist_id = get_current_dentist_id()
+        if not dentist_id:
             return redirect(url_for('login'))
+        dentist = get_dentist_from_kv(dentist_id)
+        if not dentist or dentist.get('email', '').lower() not in ADMIN_EMAILS:
+            return jsonify({'error': 'Admin access required'}), 403
         return f(*args, **kwargs)
     return decorated_function
 
 # Database functions
+# Number of keys fetched per MGET when loading lists of records
+KV_BATCH_SIZE = int(os.environ.get('KV_BATCH_SIZE', 200))
+
+# Dentist records are memoised per request and in a small per-process cache.
+# Callers get a shallow copy, so changing one never alters the cached record.
+# Set DENTIST_CACHE_SIZE=0 to disable the process cache.
+dentist_cache = TTLCache(int(os.environ.get('DENTIST_CACHE_SIZE', 256)),
+                         float(os.environ.get('DENTIST_CACHE_TTL', 30)))
+dentist_cache_stats = {'request_hits': 0, 'process_hits': 0, 'misses': 0, 'invalidations': 0}
+dentist_cache_stats_lock = threading.Lock()
+
+def count_dentist_cache(stat):
+    with dentist_cache_stats_lock:
+        dentist_cache_stats[stat] += 1
+
+def get_dentist_cache_stats():
+    with dentist_cache_stats_lock:
+        return dict(dentist_cache_stats, size=len(dentist_cache))
+
 def get_dentist_from_kv(dentist_id):
     if not redis_client:
         return None
     
-    dentist_data = redis_client.get(f"dentist:{dentist_id}")
-    if not dentist_data:
-        return None
+    request_memo = None
+    if has_request_context():
+        request_memo = g.setdefault('dentists', {})
+        if dentist_id in request_memo:
+            count_dentist_cache('request_hits')
+            return dict(request_memo[dentist_id])
     
-    try:
-        return json.loads(dentist_data)
-    except:
-        return None
+    dentist = dentist_cache.get(dentist_id)
+    if dentist is not None:
+        count_dentist_cache('process_hits')
+    else:
+        count_dentist_cache('misses')
+        dentist_data = redis_client.get(f"dentist:{dentist_id}")
+        if not dentist_data:
+            return None
+        
+        try:
+            dentist = json.loads(dentist_data)
+        except:
+            return None
+        dentist_cache.set(dentist_id, dentist)
+    
+    if request_memo is not None:
+        request_memo[dentist_id] = dentist
+    return dict(dentist)
+
+def invalidate_dentist_cache(dentist_id):
+    dentist_cache.invalidate(dentist_id)
+    if has_request_context():
+        g.setdefault('dentists', {}).pop(dentist_id, None)
+    count_dentist_cache('invalidations')
 
 def save_dentist_to_kv(dentist_data):
     if not redis_client:
@@ -136,6 +489,7 @@ def save_dentist_to_kv(dentist_data):
     
     try:
         redis_client.set(f"dentist:{dentist_data['id']}", json.dumps(dentist_data))
+        invalidate_dentist_cache(dentist_data['id'])
         return True
     except Exception as e:
         logger.error(f"Error saving dentist to KV: {str(e)}")
@@ -158,20 +512,124 @@ def get_patient_from_kv(patient_id, dentist_id=None):
     except:
         return None
 
-def save_patient_to_kv(patient_data):
+# Stored note encoding
+# Notes are stored as a 3-byte header (format version, serializer id,
+# compressor id) followed by the payload. Payloads of at least
+# RECORD_COMPRESS_THRESHOLD bytes are zlib-compressed when that makes them
+# smaller. Values written before the header existed are plain JSON objects
+# and are still read transparently. Patient records stay plain JSON because
+# Lua scripts decode them with cjson.
+RECORD_FORMAT_VERSION = 1
+RECORD_SERIALIZER = os.environ.get('RECORD_SERIALIZER', 'json')  # 'msgpack' needs the msgpack package
+RECORD_COMPRESS_THRESHOLD = int(os.environ.get('RECORD_COMPRESS_THRESHOLD', 1024))  # bytes; negative disables
+
+def _json_dumps(record):
+    return json.dumps(record, separators=(',', ':')).encode('utf-8')
+
+# name -> (id, encode, decode); ids are stored in the header and must never change
+record_serializers = {
+    'json': (1, _json_dumps, json.loads)
+}
+if msgpack:
+    record_serializers['msgpack'] = (2, lambda record: msgpack.packb(record, use_bin_type=True),
+                                     lambda payload: msgpack.unpackb(payload, raw=False))
+record_compressors = {
+    'none': (0, None, None),
+    'zlib': (1, lambda payload: zlib.compress(payload, 6), zlib.decompress)
+}
+
+if RECORD_SERIALIZER not in record_serializers:
+    logger.warning(f"⚠️ Record serializer '{RECORD_SERIALIZER}' is not available, storing notes as JSON")
+    RECORD_SERIALIZER = 'json'
+
+def encode_record(record, serializer=None, compress_threshold=None):
+    """Encode a record for storage with the configured serializer and compression."""
+    serializer_id, dumps, _ = record_serializers[serializer or RECORD_SERIALIZER]
+    compress_threshold = RECORD_COMPRESS_THRESHOLD if compress_threshold is None else compress_threshold
+    payload = dumps(record)
+    compressor_id = record_compressors['none'][0]
+    if 0 <= compress_threshold <= len(payload):
+        compressed = record_compressors['zlib'][1](payload)
+        if len(compressed) < len(payload):
+            payload, compressor_id = compressed, record_compressors['zlib'][0]
+    return bytes([RECORD_FORMAT_VERSION, serializer_id, compressor_id]) + payload
+
+def decode_record(value):
+    """Decode a stored record, accepting both encoded values and legacy JSON strings."""
+    if isinstance(value, str):
+        value = value.encode('utf-8')
+    if value[:1] != bytes([RECORD_FORMAT_VERSION]):
+        return json.loads(value)  # Legacy value written as plain JSON
+    
+    serializer_id, compressor_id, payload = value[1], value[2], value[3:]
+    decompressors = {cid: decompress for cid, _, decompress in record_compressors.values()}
+    loaders = {sid: loads for sid, _, loads in record_serializers.values()}
+    if compressor_id not in decompressors:
+        raise ValueError(f"Unknown record compressor {compressor_id}")
+    if serializer_id not in loaders:
+        raise ValueError(f"Unknown record serializer {serializer_id}")
+    if decompressors[compressor_id]:
+        payload = decompressors[compressor_id](payload)
+    return loaders[serializer_id](payload)
+
+def iter_note_key_batches():
+    """Scan for note:{id} record keys and yield them in lists of up to KV_BATCH_SIZE."""
+    keys = []
+    for key in redis_client.scan_iter(match='note:*', count=KV_BATCH_SIZE):
+        key = decode_redis_value(key)
+        if key.count(':') == 1:
+            keys.append(key)
+        if len(keys) >= KV_BATCH_SIZE:
+            yield keys
+            keys = []
+    if keys:
+        yield keys
+
+# Replaces a value only if it still holds what the migration read
+REPLACE_IF_UNCHANGED_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    redis.call('SET', KEYS[1], ARGV[2])
+    return 1
+end
+return 0
+"""
+
+def migrate_note_encoding(dry_run=False):
+    """Re-encode every stored note with the current codec settings.
+    
+    Notes changed concurrently are left alone. Returns a summary with the
+    number of notes scanned and rewritten and their total size before and after.
+    """
+    summary = {'scanned': 0, 'migrated': 0, 'bytes_before': 0, 'bytes_after': 0}
     if not redis_client:
-        return False
+        return summary
     
-    try:
-        redis_client.set(f"patient:{patient_data['id']}", json.dumps(patient_data))
-        # Add to dentist's patient list
-        dentist_id = patient_data.get('dentist_id')
-        if dentist_id:
-            redis_client.sadd(f"dentist:{dentist_id}:patients", patient_data['id'])
-        return True
-    except Exception as e:
-        logger.error(f"Error saving patient to KV: {str(e)}")
-        return False
+    for keys in iter_note_key_batches():
+        _migrate_note_batch(keys, summary, dry_run)
+    return summary
+
+def _migrate_note_batch(keys, summary, dry_run):
+    pipe = redis_client.pipeline(transaction=False)
+    for key, value in zip(keys, redis_client.mget(keys)):
+        if value is None:
+            continue
+        try:
+            encoded = encode_record(decode_record(value))
+        except (ValueError, zlib.error) as e:
+            logger.warning(f"Skipping undecodable {key}: {str(e)}")
+            continue
+        summary['scanned'] += 1
+        summary['bytes_before'] += len(value)
+        if encoded == value:
+            summary['bytes_after'] += len(value)
+            continue
+        summary['bytes_after'] += len(encoded)
+        if dry_run:
+            summary['migrated'] += 1
+        else:
+            run_lua_script(REPLACE_IF_UNCHANGED_SCRIPT, [key], [value, encoded], client=pipe)
+    if not dry_run:
+        summary['migrated'] += sum(pipe.execute())
 
 def get_note_from_kv(note_id):
     if not redis_client:
@@ -182,24 +640,138 @@ def get_note_from_kv(note_id):
         return None
     
     try:
-        return json.loads(note_data)
+        return decode_record(note_data)
     except:
         return None
 
+# Stores a note and updates its patient in one step: the note record and its
+# summary, the patient's note set and timeline, notes_count on the patient
+# record, and last_visit plus the dentist's recency index unless the patient
+# already has a later visit. Returns the new notes_count, 0 if a note with
+# this ID already exists, or nil if the patient no longer exists or belongs
+# to another dentist.
+SAVE_NOTE_SCRIPT = """
+local raw = redis.call('GET', KEYS[3])
+if not raw then
+    return nil
+end
+local patient = cjson.decode(raw)
+if patient.dentist_id ~= ARGV[3] then
+    return nil
+end
+if not redis.call('SET', KEYS[1], ARGV[1], 'NX') then
+    return 0
+end
+redis.call('SADD', KEYS[2], ARGV[2])
+patient.notes_count = (tonumber(patient.notes_count) or 0) + 1
+local last_visit = tonumber(redis.call('ZSCORE', KEYS[4], patient.id))
+if not last_visit or tonumber(ARGV[5]) >= last_visit then
+    patient.last_visit = ARGV[4]
+    redis.call('ZADD', KEYS[4], ARGV[5], patient.id)
+end
+redis.call('SET', KEYS[3], cjson.encode(patient))
+redis.call('ZADD', KEYS[5], ARGV[5], ARGV[2])
+redis.call('SET', KEYS[6], ARGV[6])
+return patient.notes_count
+"""
+
+NOTE_PREVIEW_LENGTH = 200
+
+def summarize_note(note):
+    """Build the compact record list views show instead of the full note."""
+    content = note.get('content') or ''
+    assembler = NoteSectionAssembler()
+    assembler.feed(content)
+    assembler.finish()
+    return {
+        'id': note['id'],
+        'timestamp': note.get('timestamp'),
+        'preview': content[:NOTE_PREVIEW_LENGTH],
+        'length': len(content),
+        # Sections with something documented, in template order
+        'sections': [section for section in NOTE_SECTIONS
+                     if assembler.sections.get(section, '').rstrip('.').lower() not in ('', 'none documented', 'none')]
+    }
+
+def get_note_summaries_from_kv(note_ids):
+    """Fetch note summaries in order, building and storing any that are missing."""
+    note_ids = [decode_redis_value(note_id) for note_id in note_ids]
+    summaries = {summary['id']: summary for summary in get_records_from_kv("note_summary", note_ids)}
+    missing = [note_id for note_id in note_ids if note_id not in summaries]
+    if missing:
+        logger.info(f"Backfilling {len(missing)} note summaries")
+        pipe = redis_client.pipeline(transaction=False)
+        for note in get_records_from_kv("note", missing):
+            summaries[note['id']] = summarize_note(note)
+            pipe.set(f"note_summary:{note['id']}", json.dumps(summaries[note['id']]))
+        pipe.execute()
+    return [summaries[note_id] for note_id in note_ids if note_id in summaries]
+
+def run_save_note_script(note_data, client=None, tally_key=None):
+    """Run SAVE_NOTE_SCRIPT for a note, or queue it on a pipeline passed as `client`.
+    
+    With a `tally_key`, the outcome is also counted in that import checkpoint.
+    """
+    patient_id = note_data['patient_id']
+    dentist_id = note_data['dentist_id']
+    visited_at = note_data.get('timestamp') or datetime.now().isoformat()
+    keys = [f"note:{note_data['id']}", f"patient:{patient_id}:notes",
+            f"patient:{patient_id}", f"dentist:{dentist_id}:recent_patients",
+            f"patient:{patient_id}:notes:by_time", f"note_summary:{note_data['id']}"]
+    args = [encode_record(note_data), note_data['id'], dentist_id, visited_at,
+            timestamp_score(visited_at), json.dumps(summarize_note(note_data))]
+    if tally_key:
+        return run_lua_script(IMPORT_SAVE_NOTE_SCRIPT, keys + [tally_key], args, client=client)
+    return run_lua_script(SAVE_NOTE_SCRIPT, keys, args, client=client)
+
 def save_note_to_kv(note_data):
+    """Save a note and bump its patient's notes_count and last_visit atomically.
+    
+    Returns the patient's new notes_count, or None if the note could not be saved.
+    """
     if not redis_client:
-        return False
+        return None
     
     try:
-        redis_client.set(f"note:{note_data['id']}", json.dumps(note_data))
-        # Add to patient's note list
-        patient_id = note_data.get('patient_id')
-        if patient_id:
-            redis_client.sadd(f"patient:{patient_id}:notes", note_data['id'])
-        return True
+        return run_save_note_script(note_data) or None
     except Exception as e:
         logger.error(f"Error saving note to KV: {str(e)}")
-        return False
+        return None
+
+def decode_redis_value(value):
+    """Decode a bytes value returned by Redis into a string."""
+    return value.decode('utf-8') if isinstance(value, bytes) else value
+
+def timestamp_score(iso_timestamp):
+    """Convert an ISO timestamp into a sorted-set score (0 if missing or invalid)."""
+    try:
+        return datetime.fromisoformat(iso_timestamp).timestamp()
+    except (TypeError, ValueError):
+        return 0
+
+def get_records_from_kv(key_prefix, record_ids):
+    """Fetch and decode many records with chunked MGET calls.
+
+    Records are looked up as `{key_prefix}:{id}` and decoded with
+    decode_record. Missing or undecodable records are skipped, and the input
+    order is preserved.
+    """
+    if not redis_client:
+        return []
+    
+    record_ids = [decode_redis_value(record_id) for record_id in record_ids]
+    records = []
+    for start in range(0, len(record_ids), KV_BATCH_SIZE):
+        chunk = record_ids[start:start + KV_BATCH_SIZE]
+        values = redis_client.mget([f"{key_prefix}:{record_id}" for record_id in chunk])
+        for value in values:
+            if not value:
+                continue
+            try:
+                records.append(decode_record(value))
+            except (ValueError, zlib.error):
+                logger.warning(f"Skipping undecodable {key_prefix} record")
+    return records
 
 def get_patient_notes_from_kv(patient_id):
     if not redis_client:
@@ -207,13 +779,7 @@ def get_patient_notes_from_kv(patient_id):
     
     try:
         note_ids = redis_client.smembers(f"patient:{patient_id}:notes")
-        notes = []
-        for note_id in note_ids:
-            note_id_str = note_id.decode('utf-8') if isinstance(note_id, bytes) else note_id
-            note = get_note_from_kv(note_id_str)
-            if note:
-                notes.append(note)
-        return notes
+        return get_records_from_kv("note", note_ids)
     except Exception as e:
         logger.error(f"Error getting patient notes from KV: {str(e)}")
         return []
@@ -224,17 +790,279 @@ def get_dentist_patients(dentist_id):
     
     try:
         patient_ids = redis_client.smembers(f"dentist:{dentist_id}:patients")
-        patients = []
-        for patient_id in patient_ids:
-            patient_id_str = patient_id.decode('utf-8') if isinstance(patient_id, bytes) else patient_id
-            patient = get_patient_from_kv(patient_id_str)
-            if patient:
-                patients.append(patient)
-        return patients
+        return get_records_from_kv("patient", patient_ids)
     except Exception as e:
         logger.error(f"Error getting dentist patients from KV: {str(e)}")
         return []
 
+def get_recent_patients(dentist_id, limit=5):
+    """Return the dentist's most recently visited patients and their total count.
+
+    Reads the top of the `recent_patients` sorted set instead of loading every
+    patient. Patients saved before the index existed are backfilled once.
+    """
+    if not redis_client:
+        return [], 0
+    
+    try:
+        recent_key = f"dentist:{dentist_id}:recent_patients"
+        pipe = redis_client.pipeline()
+        pipe.zrevrange(recent_key, 0, limit - 1)
+        pipe.zcard(recent_key)
+        pipe.scard(f"dentist:{dentist_id}:patients")
+        patient_ids, indexed_count, total_patients = pipe.execute()
+        
+        if indexed_count < total_patients:
+            logger.info(f"Backfilling recent patients index for dentist {dentist_id}")
+            patients = get_dentist_patients(dentist_id)
+            if patients:
+                redis_client.zadd(recent_key, {p['id']: timestamp_score(p.get('last_visit')) for p in patients})
+            patient_ids = redis_client.zrevrange(recent_key, 0, limit - 1)
+        
+        return get_records_from_kv("patient", patient_ids), total_patients
+    except Exception as e:
+        logger.error(f"Error getting recent patients from KV: {str(e)}")
+        return [], 0
+
+# Cursor pagination
+# Patients are listed from sorted-set indexes: by name from a lexicographic
+# set of "name\0id" members, by last visit from recent_patients and by
+# creation date from patients_by_created. Notes are listed newest first from
+# patient:{id}:notes:by_time. Cursors are opaque tokens holding the last item
+# of the previous page, so each page costs O(log n + page size).
+PAGE_SIZE = int(os.environ.get('PAGE_SIZE', 20))
+PAGE_SIZE_MAX = 100
+PATIENT_SORTS = {
+    # sort -> (index key suffix, newest first)
+    'name': ('patients_by_name', False),
+    'last_visit': ('recent_patients', True),
+    'created': ('patients_by_created', True)
+}
+
+def patient_name_sort_member(patient):
+    return f"{normalize_patient_name(patient.get('name'))}\0{patient['id']}"
+
+def encode_page_cursor(position):
+    return base64.urlsafe_b64encode(json.dumps(position).encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_page_cursor(cursor):
+    """Decode a cursor from a previous page; None for the first page or an invalid cursor."""
+    if not cursor:
+        return None
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        return position if isinstance(position, dict) and isinstance(position.get('m'), str) else None
+    except ValueError:
+        logger.warning("Ignoring invalid page cursor")
+        return None
+
+def page_size(value):
+    """Clamp a requested page size to 1..PAGE_SIZE_MAX, defaulting to PAGE_SIZE."""
+    try:
+        return max(1, min(int(value), PAGE_SIZE_MAX))
+    except (TypeError, ValueError):
+        return PAGE_SIZE
+
+def _scored_page(key, position, limit, newest_first):
+    # Resume right after the cursor member; if it has since been removed,
+    # resume after its score (which may repeat items that share the score).
+    start = 0
+    if position:
+        pipe = redis_client.pipeline()
+        (pipe.zrevrank if newest_first else pipe.zrank)(key, position['m'])
+        pipe.zscore(key, position['m'])
+        rank, score = pipe.execute()
+        if rank is not None and score == position.get('s'):
+            start = rank + 1
+        elif newest_first:
+            start = redis_client.zcount(key, f"({position.get('s', 0)}", '+inf')
+        else:
+            start = redis_client.zcount(key, '-inf', f"({position.get('s', 0)}")
+    fetch = redis_client.zrevrange if newest_first else redis_client.zrange
+    entries = fetch(key, start, start + limit, withscores=True)
+    return [(decode_redis_value(member), score) for member, score in entries]
+
+def ensure_patient_sort_indexes(dentist_id):
+    """Backfill the patient sort indexes for patients saved before they existed."""
+    base = f"dentist:{dentist_id}"
+    pipe = redis_client.pipeline()
+    pipe.scard(f"{base}:patients")
+    for index_key, _ in PATIENT_SORTS.values():
+        pipe.zcard(f"{base}:{index_key}")
+    total, *indexed = pipe.execute()
+    if all(count >= total for count in indexed):
+        return
+    
+    logger.info(f"Backfilling patient sort indexes for dentist {dentist_id}")
+    patients = get_dentist_patients(dentist_id)
+    if not patients:
+        return
+    pipe = redis_client.pipeline()
+    pipe.zadd(f"{base}:patients_by_name", {patient_name_sort_member(p): 0 for p in patients})
+    pipe.zadd(f"{base}:recent_patients", {p['id']: timestamp_score(p.get('last_visit')) for p in patients})
+    pipe.zadd(f"{base}:patients_by_created", {p['id']: timestamp_score(p.get('created_at')) for p in patients})
+    pipe.execute()
+
+def list_dentist_patients(dentist_id, sort='name', cursor=None, limit=None):
+    """Return one page of a dentist's patients as (patients, next_cursor).
+    
+    `sort` is one of PATIENT_SORTS; next_cursor is None on the last page.
+    """
+    if not redis_client:
+        return [], None
+    
+    limit = limit or PAGE_SIZE
+    index_key, newest_first = PATIENT_SORTS.get(sort, PATIENT_SORTS['name'])
+    key = f"dentist:{dentist_id}:{index_key}"
+    position = decode_page_cursor(cursor)
+    try:
+        ensure_patient_sort_indexes(dentist_id)
+        if index_key == 'patients_by_name':
+            start = f"({position['m']}" if position else '-'
+            members = [decode_redis_value(member) for member in
+                       redis_client.zrangebylex(key, start, '+', start=0, num=limit + 1)]
+            entries = [(member, None) for member in members]
+            patient_ids = [member.rsplit('\0', 1)[-1] for member in members]
+        else:
+            entries = _scored_page(key, position, limit, newest_first)
+            patient_ids = [member for member, _ in entries]
+        
+        next_cursor = None
+        if len(entries) > limit:
+            member, score = entries[limit - 1]
+            next_cursor = encode_page_cursor({'m': member, 's': score} if score is not None else {'m': member})
+        return get_records_from_kv("patient", patient_ids[:limit]), next_cursor
+    except Exception as e:
+        logger.error(f"Error listing dentist patients from KV: {str(e)}")
+        return [], None
+
+def list_patient_notes(patient_id, cursor=None, limit=None):
+    """Return one page of a patient's note summaries, newest first, as (summaries, next_cursor)."""
+    if not redis_client:
+        return [], None
+    
+    limit = limit or PAGE_SIZE
+    key = f"patient:{patient_id}:notes:by_time"
+    try:
+        pipe = redis_client.pipeline()
+        pipe.scard(f"patient:{patient_id}:notes")
+        pipe.zcard(key)
+        total, indexed = pipe.execute()
+        if indexed < total:
+            logger.info(f"Backfilling note timeline for patient {patient_id}")
+            notes = get_patient_notes_from_kv(patient_id)
+            if notes:
+                redis_client.zadd(key, {note['id']: timestamp_score(note.get('timestamp')) for note in notes})
+        
+        entries = _scored_page(key, decode_page_cursor(cursor), limit, True)
+        next_cursor = None
+        if len(entries) > limit:
+            member, score = entries[limit - 1]
+            next_cursor = encode_page_cursor({'m': member, 's': score})
+        return get_note_summaries_from_kv([member for member, _ in entries[:limit]]), next_cursor
+    except Exception as e:
+        logger.error(f"Error listing patient notes from KV: {str(e)}")
+        return [], None
+
+# Patient deletion
+# A patient is removed from every index and its record and notes deleted in
+# one Lua script, so a crash cannot leave half-deleted state. Patients with
+# more than DELETE_INLINE_NOTE_LIMIT notes have their note set handed to the
+# reaper queue inside the same script; the reaper then unlinks the notes in
+# batches in the background.
+DELETE_INLINE_NOTE_LIMIT = int(os.environ.get('DELETE_INLINE_NOTE_LIMIT', 1000))
+DELETE_BATCH_SIZE = 500  # notes per UNLINK call
+REAPER_PENDING_KEY = 'reaper:pending'
+reaper_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='note-reaper')
+
+# Every key the scripts touch is read in Python first and passed in KEYS.
+# KEYS: reaper queue, the patient's reaper set, patient record, timeline,
+# note set, search terms, the dentist's indexed set, patient list and sort
+# indexes, name index, then the search postings (count in ARGV[4]) and the
+# note and summary keys of the notes deleted inline (IDs from ARGV[6]).
+# Returns {notes deleted inline, notes handed to the reaper}, or nil if the
+# postings changed since they were read. Notes not passed (more than
+# DELETE_INLINE_NOTE_LIMIT, or saved meanwhile) go to the reaper.
+DELETE_PATIENT_SCRIPT = """
+local patient_id = ARGV[1]
+local posting_count, batch_size = tonumber(ARGV[4]), tonumber(ARGV[5])
+if redis.call('SCARD', KEYS[6]) ~= posting_count then
+    return nil
+end
+for i = 13, 12 + posting_count do
+    if redis.call('SISMEMBER', KEYS[6], KEYS[i]) == 0 then
+        return nil
+    end
+end
+for i = 13, 12 + posting_count do
+    redis.call('SREM', KEYS[i], patient_id)
+end
+redis.call('DEL', KEYS[6])
+redis.call('SREM', KEYS[7], patient_id)
+redis.call('SREM', KEYS[8], patient_id)
+redis.call('ZREM', KEYS[9], patient_id)
+redis.call('ZREM', KEYS[10], patient_id)
+redis.call('ZREM', KEYS[11], ARGV[2])
+if redis.call('HGET', KEYS[12], ARGV[3]) == patient_id then
+    redis.call('HDEL', KEYS[12], ARGV[3])
+end
+redis.call('UNLINK', KEYS[3], KEYS[4])
+
+local deleted = 0
+local first_note_key = 13 + posting_count
+for first = 6, #ARGV, batch_size do
+    local last = math.min(first + batch_size - 1, #ARGV)
+    deleted = deleted + redis.call('SREM', KEYS[5], unpack(ARGV, first, last))
+    local key_offset = first_note_key + (first - 6) * 2
+    redis.call('UNLINK', unpack(KEYS, key_offset, key_offset + (last - first) * 2 + 1))
+end
+local deferred = redis.call('SCARD', KEYS[5])
+if deferred > 0 then
+    redis.call('SUNIONSTORE', KEYS[2], KEYS[2], KEYS[5])
+    redis.call('SADD', KEYS[1], KEYS[2])
+end
+redis.call('DEL', KEYS[5])
+return {deleted, deferred}
+"""
+DELETE_PATIENT_ATTEMPTS = 3
+
+# Unlinks one batch of notes (IDs in ARGV, their note and summary keys from
+# KEYS[3]) from a pending reaper set (KEYS[2]), dropping the set from the
+# queue (KEYS[1]) once empty; returns the number unlinked.
+REAP_NOTES_SCRIPT = """
+local removed = 0
+if #ARGV > 0 then
+    removed = redis.call('SREM', KEYS[2], unpack(ARGV))
+    redis.call('UNLINK', unpack(KEYS, 3))
+end
+if redis.call('SCARD', KEYS[2]) == 0 then
+    redis.call('SREM', KEYS[1], KEYS[2])
+end
+return removed
+"""
+
+def note_record_keys(note_ids):
+    """Return the note and note_summary keys of each note, interleaved."""
+    return [key for note_id in note_ids for key in (f"note:{note_id}", f"note_summary:{note_id}")]
+
+def run_delete_patient_script(patient):
+    """Run DELETE_PATIENT_SCRIPT for a patient; return (deleted, deferred) or None if its postings changed."""
+    patient_id = patient['id']
+    base = f"dentist:{patient['dentist_id']}"
+    terms_key = f"{base}:search:terms:{patient_id}"
+    notes_key = f"patient:{patient_id}:notes"
+    postings = sorted(decode_redis_value(term) for term in redis_client.smembers(terms_key))
+    note_ids = []
+    if redis_client.scard(notes_key) <= DELETE_INLINE_NOTE_LIMIT:
+        note_ids = sorted(decode_redis_value(note_id) for note_id in redis_client.smembers(notes_key))
+    keys = [REAPER_PENDING_KEY, f"reaper:notes:{patient_id}", f"patient:{patient_id}",
+            f"patient:{patient_id}:notes:by_time", notes_key, terms_key, f"{base}:search:indexed",
+            f"{base}:patients", f"{base}:recent_patients", f"{base}:patients_by_created",
+            f"{base}:patients_by_name", f"{base}:patient_names", *postings, *note_record_keys(note_ids)]
+    args = [patient_id, patient_name_sort_member(patient), normalize_patient_name(patient.get('name')),
+            len(postings), DELETE_BATCH_SIZE, *note_ids]
+    return run_lua_script(DELETE_PATIENT_SCRIPT, keys, args)
+
 def delete_patient_from_kv(patient_id, dentist_id):
     """Deletes a patient and all their associated notes from Redis."""
     if not redis_client:
@@ -249,27 +1077,19 @@ def delete_patient_from_kv(patient_id, dentist_id):
             return False
 
         logger.info(f"Starting deletion for patient {patient_id} belonging to dentist {dentist_id}")
-        
-        # 1. Get all notes associated with the patient
-        note_ids = redis_client.smembers(f"patient:{patient_id}:notes")
-        
-        # 2. Delete each note individually
-        for note_id_bytes in note_ids:
-            note_id = note_id_bytes.decode('utf-8') if isinstance(note_id_bytes, bytes) else note_id_bytes
-            logger.info(f"Deleting note {note_id} for patient {patient_id}")
-            redis_client.delete(f"note:{note_id}")
-        
-        # 3. Delete the patient's notes set
-        redis_client.delete(f"patient:{patient_id}:notes")
-        
-        # 4. Remove patient from dentist's patient list
-        redis_client.srem(f"dentist:{dentist_id}:patients", patient_id)
-        logger.info(f"Removed patient {patient_id} from dentist {dentist_id}'s patient list")
-        
-        # 5. Delete the patient record itself
-        redis_client.delete(f"patient:{patient_id}")
-        logger.info(f"Deleted patient record {patient_id}")
-        
+        for _ in range(DELETE_PATIENT_ATTEMPTS):
+            result = run_delete_patient_script(patient)
+            if result is not None:
+                break
+            logger.info(f"Search postings of patient {patient_id} changed during deletion; retrying")
+        else:
+            logger.error(f"Could not delete patient {patient_id}: search postings kept changing")
+            return False
+        deleted, deferred = result
+        logger.info(f"Deleted patient record {patient_id} and {deleted} notes")
+        if deferred:
+            logger.info(f"🧹 Queued {deferred} notes of patient {patient_id} for background deletion")
+            reaper_executor.submit(reap_deleted_notes)
         return True
         
     except Exception as e:
@@ -277,19 +1097,156 @@ def delete_patient_from_kv(patient_id, dentist_id):
         logger.error(traceback.format_exc())
         return False
 
-def is_patient_id_unique(patient_id):
-    """Check if a patient ID is unique across the entire system."""
+def reap_deleted_notes(max_batches=None):
+    """Unlink notes queued by delete_patient_from_kv in batches; return the number removed."""
     if not redis_client:
-        logger.error("Redis client not available for checking patient ID uniqueness")
-        return False
+        return 0
     
+    removed = 0
+    batches = 0
     try:
-        # Check if any patient with this ID exists
-        existing_patient = redis_client.get(f"patient:{patient_id}")
-        return existing_patient is None
+        while max_batches is None or batches < max_batches:
+            reap_key = redis_client.srandmember(REAPER_PENDING_KEY)
+            if not reap_key:
+                break
+            reap_key = decode_redis_value(reap_key)
+            note_ids = [decode_redis_value(note_id) for note_id in redis_client.srandmember(reap_key, DELETE_BATCH_SIZE)]
+            removed += run_lua_script(REAP_NOTES_SCRIPT, [REAPER_PENDING_KEY, reap_key, *note_record_keys(note_ids)],
+                                      note_ids)
+            batches += 1
+        if removed:
+            logger.info(f"🧹 Reaper removed {removed} notes of deleted patients")
     except Exception as e:
-        logger.error(f"Error checking patient ID uniqueness: {str(e)}")
-        return False
+        logger.error(f"Error reaping deleted notes: {str(e)}")
+    return removed
+
+def find_orphan_notes(fix=False):
+    """Scan note:* keys for notes whose patient is gone or no longer lists them.
+    
+    Notes already queued for the reaper are not reported. With fix=True the
+    orphans are unlinked. Returns a summary dict.
+    """
+    summary = {'scanned': 0, 'orphans': [], 'removed': 0}
+    if not redis_client:
+        return summary
+    
+    for keys in iter_note_key_batches():
+        _collect_orphan_notes(keys, summary)
+    
+    if fix:
+        for i in range(0, len(summary['orphans']), DELETE_BATCH_SIZE):
+            batch = summary['orphans'][i:i + DELETE_BATCH_SIZE]
+            summary['removed'] += redis_client.unlink(*[f"note:{note_id}" for note_id in batch])
+            redis_client.unlink(*[f"note_summary:{note_id}" for note_id in batch])
+    return summary
+
+def _collect_orphan_notes(keys, summary):
+    note_ids = [key.split(':', 1)[1] for key in keys]
+    notes = redis_client.mget(keys)
+    pipe = redis_client.pipeline()
+    for note_id, raw in zip(note_ids, notes):
+        try:
+            patient_id = decode_record(raw).get('patient_id') if raw else None
+        except (ValueError, zlib.error):
+            patient_id = None
+        pipe.exists(f"patient:{patient_id}")
+        pipe.sismember(f"patient:{patient_id}:notes", note_id)
+        pipe.sismember(f"reaper:notes:{patient_id}", note_id)
+    results = pipe.execute()
+    for index, note_id in enumerate(note_ids):
+        if notes[index] is None:
+            continue  # Deleted since the scan
+        summary['scanned'] += 1
+        patient_exists, listed, queued = results[index * 3:index * 3 + 3]
+        if queued or (patient_exists and listed):
+            continue
+        summary['orphans'].append(note_id)
+
+# Patient creation
+# dentist:{id}:patient_names maps each normalised patient name to its patient
+# ID so duplicate names are caught without loading every patient. The empty
+# field marks the hash as complete; dentists with patients created before
+# the index existed are backfilled on their first new patient.
+def normalize_patient_name(name):
+    return ' '.join((name or '').casefold().split())
+
+# Reserves the patient ID (SET NX) and the name (HSETNX) and adds the patient
+# to the list and sort indexes and its search postings, all or nothing. KEYS:
+# patient record, name index, patient list, recency, created and name sort
+# indexes, search terms, indexed set, then the postings; no key is built in
+# Lua. Returns 'created',
+# 'id_taken', 'name_taken' or 'backfill' when the name index is incomplete.
+CREATE_PATIENT_SCRIPT = """
+if redis.call('HEXISTS', KEYS[2], '') == 0 and redis.call('SCARD', KEYS[3]) > 0 then
+    return 'backfill'
+end
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return 'id_taken'
+end
+if redis.call('HSETNX', KEYS[2], ARGV[2], ARGV[3]) == 0 then
+    return 'name_taken'
+end
+redis.call('SET', KEYS[1], ARGV[1], 'NX')
+redis.call('HSETNX', KEYS[2], '', '1')
+redis.call('SADD', KEYS[3], ARGV[3])
+redis.call('ZADD', KEYS[4], ARGV[4], ARGV[3])
+redis.call('ZADD', KEYS[5], ARGV[5], ARGV[3])
+redis.call('ZADD', KEYS[6], 0, ARGV[6])
+for i = 9, #KEYS do
+    redis.call('SADD', KEYS[i], ARGV[3])
+    redis.call('SADD', KEYS[7], KEYS[i])
+end
+redis.call('SADD', KEYS[8], ARGV[3])
+return 'created'
+"""
+
+def backfill_patient_names(dentist_id):
+    """Index the names of a dentist's existing patients and mark the index complete."""
+    names_key = f"dentist:{dentist_id}:patient_names"
+    pipe = redis_client.pipeline()
+    for patient in get_dentist_patients(dentist_id):
+        name = normalize_patient_name(patient.get('name'))
+        if name:
+            pipe.hsetnx(names_key, name, patient['id'])
+    pipe.hset(names_key, '', '1')
+    pipe.execute()
+
+def run_create_patient_script(patient_data, client=None, tally_key=None):
+    """Run CREATE_PATIENT_SCRIPT for a patient, or queue it on a pipeline passed as `client`.
+    
+    With a `tally_key`, the outcome is also counted in that import checkpoint.
+    """
+    base = f"dentist:{patient_data['dentist_id']}"
+    keys = [f"patient:{patient_data['id']}", f"{base}:patient_names", f"{base}:patients",
+            f"{base}:recent_patients", f"{base}:patients_by_created", f"{base}:patients_by_name",
+            f"{base}:search:terms:{patient_data['id']}", f"{base}:search:indexed",
+            *sorted(search_index_terms(patient_data))]
+    args = [json.dumps(patient_data), normalize_patient_name(patient_data['name']), patient_data['id'],
+            timestamp_score(patient_data.get('last_visit')), timestamp_score(patient_data.get('created_at')),
+            patient_name_sort_member(patient_data)]
+    if tally_key:
+        return run_lua_script(IMPORT_CREATE_PATIENT_SCRIPT, keys + [tally_key], args, client=client)
+    return run_lua_script(CREATE_PATIENT_SCRIPT, keys, args, client=client)
+
+def create_patient_in_kv(patient_data):
+    """Create a new patient if both its ID and its name (for the dentist) are free.
+    
+    Returns 'created', 'id_taken', 'name_taken', or None if Redis failed.
+    """
+    if not redis_client:
+        logger.error("Redis client not available for creating patient")
+        return None
+    
+    try:
+        result = decode_redis_value(run_create_patient_script(patient_data))
+        if result == 'backfill':
+            logger.info(f"Backfilling patient name index for dentist {patient_data['dentist_id']}")
+            backfill_patient_names(patient_data['dentist_id'])
+            result = decode_redis_value(run_create_patient_script(patient_data))
+        return result
+    except Exception as e:
+        logger.error(f"Error creating patient in KV: {str(e)}")
+        return None
 
 def validate_patient_id_format(patient_id):
     """Validate patient ID format and return error message if invalid."""
@@ -310,52 +1267,499 @@ def validate_patient_id_format(patient_id):
     
     return None  # No validation errors
 
-def process_speech_text(text):
-    text = text.strip()
-    common_endings = ['patient', 'treatment', 'cavity', 'procedure', 'tooth', 'examination', 'recommended', 'performed', 'completed', 'noted', 'observed', 'found', 'present', 'visible', 'detected']
-    words = text.split()
-    processed_words = []
-    for i, word in enumerate(words):
-        processed_words.append(word)
-        if (i < len(words) - 1 and word.lower() in common_endings and words[i + 1][0].isupper()):
-            processed_words[-1] = word + "."
-        if (re.match(r'#?\d{1,2}$', word) and i < len(words) - 1 and not words[i + 1].startswith('#')):
-            processed_words[-1] = word + ","
-        if word.lower() in ['however', 'additionally', 'furthermore', 'moreover']:
-            processed_words[-1] = word + ","
-    text = ' '.join(processed_words)
-    if not text.endswith(('.', '!', '?')): text += '.'
-    text = re.sub(r'\band\s+and\s+', ' and ', text)
-    text = re.sub(r'\bum\s+', '', text)
-    text = re.sub(r'\buh\s+', '', text)
-    text = re.sub(r'\s+', ' ', text)
-    return text
-
-def generate_clinical_note(transcription, patient_name):
-    """Generate a clinical note using multiple AI models with retry logic."""
+# Patient search index
+# Names and IDs are posted under every substring up to SEARCH_NGRAM_SIZE characters,
+# and names additionally under their prefixes up to SEARCH_PREFIX_LENGTH characters.
+SEARCH_NGRAM_SIZE = 3
+SEARCH_PREFIX_LENGTH = 16
+SEARCH_SCAN_COUNT = 100  # SSCAN batch size when reading a posting
+
+def _search_ngrams(text):
+    return {text[i:i + n] for n in range(1, SEARCH_NGRAM_SIZE + 1) for i in range(len(text) - n + 1)}
+
+def search_index_terms(patient):
+    """Return the posting keys a patient belongs to in its dentist's search index."""
+    base = f"dentist:{patient['dentist_id']}:search"
+    name = patient.get('name', '').lower()
+    terms = {f"{base}:prefix:{name[:n]}" for n in range(1, min(len(name), SEARCH_PREFIX_LENGTH) + 1)}
+    terms.update(f"{base}:name:{gram}" for gram in _search_ngrams(name))
+    terms.update(f"{base}:id:{gram}" for gram in _search_ngrams(patient['id'].lower()))
+    return terms
+
+def index_patient_for_search(patient):
+    """Add or refresh a patient's postings, removing any left over from an old name."""
+    dentist_id = patient.get('dentist_id')
+    if not redis_client or not dentist_id:
+        return
+    
+    terms_key = f"dentist:{dentist_id}:search:terms:{patient['id']}"
+    old_terms = {decode_redis_value(term) for term in redis_client.smembers(terms_key)}
+    new_terms = search_index_terms(patient)
+    
+    pipe = redis_client.pipeline()
+    for term in old_terms - new_terms:
+        pipe.srem(term, patient['id'])
+    for term in new_terms - old_terms:
+        pipe.sadd(term, patient['id'])
+    if old_terms != new_terms:
+        pipe.delete(terms_key)
+        pipe.sadd(terms_key, *new_terms)
+    pipe.sadd(f"dentist:{dentist_id}:search:indexed", patient['id'])
+    pipe.execute()
+
+def patient_search_relevance(patient, query):
+    """Score a patient against a lowercase query: 3 name prefix, 2 name substring, 1 ID substring, 0 no match."""
+    name = patient['name'].lower()
+    if name.startswith(query):
+        return 3
+    if query in name:
+        return 2
+    if query in patient['id'].lower():
+        return 1
+    return 0
+
+def _search_candidates(base, field, query):
+    """Yield candidate patient IDs for one tier, scanning its posting incrementally."""
+    # Queries no longer than the n-gram size are exact postings. Longer ones scan
+    # their rarest n-gram's posting; candidates are verified against the record.
+    if field == 'prefix' or len(query) <= SEARCH_NGRAM_SIZE:
+        key = f"{base}:{field}:{query[:SEARCH_PREFIX_LENGTH] if field == 'prefix' else query}"
+    else:
+        keys = [f"{base}:{field}:{query[i:i + SEARCH_NGRAM_SIZE]}" for i in range(len(query) - SEARCH_NGRAM_SIZE + 1)]
+        pipe = redis_client.pipeline()
+        for gram_key in keys:
+            pipe.scard(gram_key)
+        size, key = min(zip(pipe.execute(), keys))
+        if not size:
+            return
+    for patient_id in redis_client.sscan_iter(key, count=SEARCH_SCAN_COUNT):
+        yield decode_redis_value(patient_id)
+
+def search_dentist_patients(dentist_id, query, limit=10):
+    """Return up to `limit` of the dentist's patients matching `query`, best matches first.
+
+    Tiers are read lazily: a tier's posting is only scanned while the better
+    tiers have returned fewer than `limit` results, and only candidates not
+    already matched are fetched, so short queries that match most of a
+    practice stay cheap. A later tier is only reached once the better ones
+    are exhausted, so results are the same as a full tiered search, with
+    the same `relevance` tiers.
+    """
+    if not redis_client:
+        return []
+    
+    base = f"dentist:{dentist_id}:search"
+    
+    pipe = redis_client.pipeline()
+    pipe.scard(f"{base}:indexed")
+    pipe.scard(f"dentist:{dentist_id}:patients")
+    indexed_count, total_patients = pipe.execute()
+    if indexed_count < total_patients:
+        logger.info(f"Backfilling search index for dentist {dentist_id}")
+        indexed = {decode_redis_value(pid) for pid in redis_client.smembers(f"{base}:indexed")}
+        for patient in get_dentist_patients(dentist_id):
+            if patient['id'] not in indexed:
+                index_patient_for_search(patient)
+    
+    results = []
+    seen = set()
+    for relevance, field in ((3, 'prefix'), (2, 'name'), (1, 'id')):
+        candidates = (pid for pid in _search_candidates(base, field, query) if pid not in seen)
+        while len(results) < limit:
+            batch = list(islice(candidates, limit))
+            if not batch:
+                break  # Tier exhausted
+            for patient in get_records_from_kv("patient", batch):
+                if patient.get('dentist_id') != dentist_id or patient['id'] in seen:
+                    continue
+                if patient_search_relevance(patient, query) != relevance:
+                    continue
+                patient_result = patient.copy()
+                patient_result['relevance'] = relevance
+                results.append(patient_result)
+                seen.add(patient['id'])
+                if len(results) >= limit:
+                    return results
+    return results
+
+# Bulk import and export
+# Records are one JSON object per line (NDJSON) or CSV rows with the columns
+# in TRANSFER_FIELDS, and carry a "type" of "patient" or "note". Imports are
+# read through generators and written in batches of IMPORT_BATCH_SIZE, each
+# batch one MULTI transaction that also advances the job's checkpoint, so an
+# interrupted import resumes with the same job ID exactly where it stopped.
+# Notes without an ID get one derived from the job ID and line number, so
+# replaying a batch never duplicates them.
+IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE', 500))
+IMPORT_CHECKPOINT_TTL = int(os.environ.get('IMPORT_CHECKPOINT_TTL', 7 * 86400))
+IMPORT_MAX_ERRORS = 100  # error details kept in the summary
+TRANSFER_FORMATS = ('ndjson', 'csv')
+TRANSFER_FIELDS = ['type', 'id', 'patient_id', 'name', 'created_at', 'last_visit', 'timestamp', 'content', 'transcription']
+
+# Runs a create or save script with the checkpoint key appended to KEYS and
+# counts its outcome in the checkpoint, so the counts commit with the records.
+IMPORT_TALLY_SCRIPT = """
+local tally = table.remove(KEYS)
+local function run()
+{script}
+end
+local result = run()
+local field = 'failed'
+if result == 'created' then
+    field = 'patients'
+elseif result == 'id_taken' or result == 'name_taken' or result == 0 then
+    field = 'skipped'
+elseif type(result) == 'number' then
+    field = 'notes'
+end
+redis.call('HINCRBY', tally, field, 1)
+return result
+"""
+IMPORT_CREATE_PATIENT_SCRIPT = IMPORT_TALLY_SCRIPT.replace('{script}', CREATE_PATIENT_SCRIPT)
+IMPORT_SAVE_NOTE_SCRIPT = IMPORT_TALLY_SCRIPT.replace('{script}', SAVE_NOTE_SCRIPT)
+
+def transfer_format(name, filename=None):
+    """Pick the transfer format from an explicit name or a file extension; None if unsupported."""
+    if not name and filename:
+        name = 'csv' if filename.lower().endswith('.csv') else 'ndjson'
+    name = (name or 'ndjson').lower()
+    return name if name in TRANSFER_FORMATS else None
+
+def iter_import_records(lines, fmt):
+    """Yield (line number, record or None) from an iterable of text lines; None marks unparsable input."""
+    if fmt == 'csv':
+        reader = csv.DictReader(lines)
+        for record in reader:
+            yield reader.line_num, {key: value for key, value in record.items() if key and value not in (None, '')}
+        return
+    for line_number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            record = None
+        yield line_number, record if isinstance(record, dict) else None
+
+def _iso_or_now(value):
+    if not value:
+        return datetime.now().isoformat()
+    datetime.fromisoformat(value)  # Raises ValueError when malformed
+    return value
+
+def validate_import_record(record, dentist_id, default_note_id=None):
+    """Return (type, normalised record, error) for one imported record."""
+    if record is None:
+        return None, None, "Unparsable record"
+    record_type = record.get('type')
     try:
-        logger.info(f"Starting clinical note generation for patient: {patient_name}")
-        logger.info(f"Transcription length: {len(transcription)}")
+        if record_type == 'patient':
+            patient_id = str(record.get('id') or '').strip()
+            format_error = validate_patient_id_format(patient_id)
+            if format_error:
+                return record_type, None, format_error
+            name = str(record.get('name') or '').strip()
+            if not normalize_patient_name(name):
+                return record_type, None, "Patient name is required"
+            created_at = _iso_or_now(record.get('created_at'))
+            return record_type, {
+                'id': patient_id,
+                'name': name,
+                'dentist_id': dentist_id,
+                'created_at': created_at,
+                'last_visit': _iso_or_now(record.get('last_visit') or created_at),
+                'notes_count': 0
+            }, None
+        if record_type == 'note':
+            patient_id = str(record.get('patient_id') or '').strip()
+            if not patient_id:
+                return record_type, None, "Note patient_id is required"
+            if not record.get('content'):
+                return record_type, None, "Note content is required"
+            return record_type, {
+                'id': str(record.get('id') or default_note_id or uuid.uuid4()),
+                'content': str(record['content']),
+                'transcription': str(record.get('transcription') or ''),
+                'timestamp': _iso_or_now(record.get('timestamp')),
+                'patient_id': patient_id,
+                'dentist_id': dentist_id,
+                'patient_name': record.get('patient_name')
+            }, None
+    except ValueError:
+        return record_type, None, "Invalid ISO timestamp"
+    return record_type, None, "Record type must be 'patient' or 'note'"
+
+def get_import_checkpoint(job_id):
+    raw = redis_client.hgetall(f"import:{job_id}")
+    checkpoint = {decode_redis_value(key): decode_redis_value(value) for key, value in raw.items()}
+    for field in ('position', 'patients', 'notes', 'skipped', 'failed'):
+        checkpoint[field] = int(checkpoint.get(field, 0))
+    return checkpoint
+
+def import_records(dentist_id, records, job_id=None, batch_size=None):
+    """Import (line number, record) pairs for a dentist and return a summary.
+    
+    Existing patient IDs, names already used by the dentist and existing
+    note IDs are skipped. Passing the job_id of an interrupted import skips
+    the records it already committed.
+    """
+    job_id = job_id or str(uuid.uuid4())
+    batch_size = batch_size or IMPORT_BATCH_SIZE
+    checkpoint = get_import_checkpoint(job_id)
+    if checkpoint.get('dentist_id', dentist_id) != dentist_id:
+        raise ValueError(f"Import job {job_id} belongs to another dentist")
+    summary = dict(checkpoint, job_id=job_id, dentist_id=dentist_id, errors=[])
+    
+    names_key = f"dentist:{dentist_id}:patient_names"
+    if not redis_client.hexists(names_key, '') and redis_client.scard(f"dentist:{dentist_id}:patients"):
+        backfill_patient_names(dentist_id)
+    
+    def fail(line_number, error):
+        if len(summary['errors']) < IMPORT_MAX_ERRORS:
+            summary['errors'].append({'line': line_number, 'error': error})
+    
+    def commit(batch, invalid, position):
+        checkpoint_key = f"import:{job_id}"
+        pipe = redis_client.pipeline(transaction=True)
+        for _, record_type, record in batch:
+            if record_type == 'patient':
+                run_create_patient_script(record, client=pipe, tally_key=checkpoint_key)
+            else:
+                run_save_note_script(record, client=pipe, tally_key=checkpoint_key)
+        if invalid:
+            pipe.hincrby(checkpoint_key, 'failed', invalid)
+        pipe.hset(checkpoint_key, mapping={'dentist_id': dentist_id, 'position': position})
+        pipe.expire(checkpoint_key, IMPORT_CHECKPOINT_TTL)
+        results = pipe.execute()[:len(batch)]
         
-        if not OPENROUTER_API_KEY:
-            logger.error("OpenRouter API key not found in environment variables")
-            return generate_basic_note(transcription, patient_name)
-
-        # Get dentist name from current dentist
-        dentist_id = request.cookies.get('dentist_id')
-        dentist_name = 'Doctor'
-        if dentist_id:
-            dentist = get_dentist_from_kv(dentist_id)
-            if dentist:
-                dentist_name = dentist.get('name', 'Doctor')
-
-        # Get current timestamp for the clinical note
-        current_time = datetime.now().strftime("%B %d, %Y at %I:%M %p")
-        logger.info(f"Using timestamp: {current_time}")
+        for (line_number, record_type, record), result in zip(batch, results):
+            result = decode_redis_value(result)
+            if record_type == 'patient':
+                if result not in ('created', 'id_taken', 'name_taken'):
+                    fail(line_number, f"Patient not created: {result}")
+            elif result is None:
+                fail(line_number, f"Unknown patient {record['patient_id']}")
+    
+    batch = []
+    invalid = 0
+    position = committed = checkpoint['position']
+    for line_number, raw in islice(records, checkpoint['position'], None):
+        position += 1
+        record_type, record, error = validate_import_record(
+            raw, dentist_id, str(uuid.uuid5(uuid.NAMESPACE_URL, f"import:{job_id}:{line_number}")))
+        if error:
+            invalid += 1
+            fail(line_number, error)
+        else:
+            batch.append((line_number, record_type, record))
+        if position - committed >= batch_size:
+            commit(batch, invalid, position)
+            batch, invalid, committed = [], 0, position
+    if position > committed or not checkpoint.get('dentist_id'):
+        commit(batch, invalid, position)
+    summary.update(get_import_checkpoint(job_id))
+    logger.info(f"📥 Import {job_id} for dentist {dentist_id}: {summary['patients']} patients, "
+                f"{summary['notes']} notes, {summary['skipped']} skipped, {summary['failed']} failed")
+    return summary
+
+def iter_export_records(dentist_id):
+    """Yield a dentist's patients, each followed by its notes, reading in batches."""
+    for patient_ids in _iter_set_batches(f"dentist:{dentist_id}:patients"):
+        for patient in get_records_from_kv("patient", patient_ids):
+            yield dict(patient, type='patient')
+            for note_ids in _iter_set_batches(f"patient:{patient['id']}:notes"):
+                for note in get_records_from_kv("note", note_ids):
+                    yield dict(note, type='note')
+
+def _iter_set_batches(key):
+    batch = []
+    for member in redis_client.sscan_iter(key, count=KV_BATCH_SIZE):
+        batch.append(member)
+        if len(batch) >= KV_BATCH_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def format_export_records(records, fmt):
+    """Yield export records as NDJSON lines or CSV rows (with a header row)."""
+    if fmt == 'csv':
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=TRANSFER_FIELDS, extrasaction='ignore')
+        writer.writeheader()
+        for record in records:
+            writer.writerow(record)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+        return
+    for record in records:
+        yield json.dumps({field: record[field] for field in TRANSFER_FIELDS if record.get(field) is not None}) + '\n'
+
+# Speech text normalisation
+# Dictated text is normalised by a pipeline of token generators, so long
+# dictations are processed in one linear pass and can be fed in chunks.
+# Each stage reproduces one of the original regex passes exactly.
+SENTENCE_ENDING_WORDS = frozenset(['patient', 'treatment', 'cavity', 'procedure', 'tooth', 'examination', 'recommended', 'performed', 'completed', 'noted', 'observed', 'found', 'present', 'visible', 'detected'])
+TRANSITION_WORDS = frozenset(['however', 'additionally', 'furthermore', 'moreover'])
+_TOOTH_NUMBER_RE = re.compile(r'#?\d{1,2}$')
+# Suffixes preceded by a word boundary, i.e. the token is the word or ends in punctuation before it
+_AND_SUFFIX_RE = re.compile(r'(?<!\w)and\Z')
+_FILLER_SUFFIX_RE = re.compile(r'(?<!\w)(?:um|uh)\Z')
+
+def _iter_speech_words(chunks):
+    """Split chunks of text into whitespace-separated words, joining words cut at chunk edges."""
+    pending = ''
+    for chunk in chunks:
+        if not chunk:
+            continue
+        buffer = pending + chunk
+        words = buffer.split()
+        pending = words.pop() if words and not buffer[-1].isspace() else ''
+        yield from words
+    if pending:
+        yield pending
+
+def _punctuate_speech_words(words):
+    # Full stop after sentence-ending words followed by a capital, commas after
+    # tooth numbers and transition words, and a full stop to close the text.
+    words = iter(words)
+    word = next(words, None)
+    if word is None:
+        yield '.'
+        return
+    for next_word in words:
+        lower = word.lower()
+        if lower in TRANSITION_WORDS:
+            yield word + ','
+        elif _TOOTH_NUMBER_RE.match(word) and not next_word.startswith('#'):
+            yield word + ','
+        elif lower in SENTENCE_ENDING_WORDS and next_word[0].isupper():
+            yield word + '.'
+        else:
+            yield word
+        word = next_word
+    if word.lower() in TRANSITION_WORDS:
+        word += ','
+    yield word if word.endswith(('.', '!', '?')) else word + '.'
+
+def _collapse_repeated_and(tokens):
+    # "and and" becomes a single "and". A word glued to the first "and"
+    # ("x-and and") keeps its prefix as a separate token, and a match at the
+    # very start leaves a leading space, which is emitted as an empty token.
+    tokens = iter(tokens)
+    window = deque(islice(tokens, 3))
+    at_start = True
+    while window:
+        token = window[0]
+        if len(window) == 3 and window[1] == 'and' and _AND_SUFFIX_RE.search(token):
+            prefix = token[:-3]
+            if prefix or at_start:
+                yield prefix
+            yield 'and'
+            window.popleft()
+            window.popleft()
+        else:
+            yield window.popleft()
+        at_start = False
+        window.extend(islice(tokens, 3 - len(window)))
+
+def _drop_filler_words(tokens):
+    # "um" and "uh" (alone or after punctuation) are removed along with the
+    # space after them, gluing any leftover punctuation to the next token.
+    carry = ''
+    previous = None
+    for token in tokens:
+        if previous is not None:
+            filler = _FILLER_SUFFIX_RE.search(previous)
+            if filler:
+                carry += previous[:filler.start()]
+            else:
+                yield carry + previous
+                carry = ''
+        previous = token
+    if previous is not None:
+        yield carry + previous
+
+def iter_processed_speech(chunks):
+    """Normalise dictated text given as an iterable of chunks, yielding output pieces."""
+    tokens = _drop_filler_words(_collapse_repeated_and(_punctuate_speech_words(_iter_speech_words(chunks))))
+    first = next(tokens)
+    yield first
+    for token in tokens:
+        yield ' ' + token
 
-        prompt = f"""Task: Convert an informal dental transcription into a formal dental clinical note that follows the exact template and style provided below.
+def process_speech_text(text):
+    return ''.join(iter_processed_speech([text]))
+
+# Clinical note generation
+OPENROUTER_API_URL = os.environ.get('OPENROUTER_API_URL', "https://openrouter.ai/api/v1/chat/completions")
+# Connect and read timeouts are applied separately; the read timeout is capped
+# by the remaining note deadline.
+OPENROUTER_CONNECT_TIMEOUT = float(os.environ.get('OPENROUTER_CONNECT_TIMEOUT', 5))
+OPENROUTER_POOL_SIZE = int(os.environ.get('OPENROUTER_POOL_SIZE', 16))
+
+def create_openrouter_session():
+    """Create a keep-alive HTTP session so note requests reuse TCP/TLS connections."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=OPENROUTER_POOL_SIZE, max_retries=0)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+openrouter_session = create_openrouter_session()
+
+# Multiple free models to try (in order of preference)
+NOTE_MODELS = [
+    {
+        "name": "qwen/qwen3-30b-a3b:free",
+        "description": "Qwen3 30B (Primary - Best Quality)",
+        "max_tokens": 1000,
+        "temperature": 0.7
+    },
+    {
+        "name": "deepseek/deepseek-r1:free", 
+        "description": "DeepSeek R1 (Fallback 1 - Latest)",
+        "max_tokens": 1000,
+        "temperature": 0.6
+    },
+    {
+        "name": "meta-llama/llama-3.3-70b-instruct:free",
+        "description": "Llama 3.3 70B (Fallback 2 - Large)",
+        "max_tokens": 1000,
+        "temperature": 0.7
+    },
+    {
+        "name": "qwen/qwen3-0.6b-04-28:free",
+        "description": "Qwen3 0.6B (Fallback 3 - Fast)",
+        "max_tokens": 800,
+        "temperature": 0.8
+    }
+]
+
+# Overall time budget for one note across all model attempts
+NOTE_DEADLINE_SECONDS = float(os.environ.get('NOTE_DEADLINE_SECONDS', 90))
+# Start the next fallback model if no answer has arrived after this many seconds
+# (0 disables hedging: fallbacks then start only when the previous model fails)
+NOTE_HEDGE_DELAY = float(os.environ.get('NOTE_HEDGE_DELAY', 10))
+# A race may have every model in flight, so the pool holds NOTE_MODEL_RACES
+# races' worth of threads. A race keeps its slot until its last attempt has
+# actually stopped, so cancelled attempts can never starve the next race.
+NOTE_MODEL_RACES = int(os.environ.get('NOTE_MODEL_RACES', 8))
+note_model_executor = ThreadPoolExecutor(max_workers=NOTE_MODEL_RACES * len(NOTE_MODELS),
+                                         thread_name_prefix='note-model')
+note_race_slots = threading.BoundedSemaphore(NOTE_MODEL_RACES)
+
+class ModelAttemptError(Exception):
+    """Raised when a single model attempt fails or returns an unusable note."""
+    
+    def __init__(self, message, rate_limited=False, retry_after=None):
+        super().__init__(message)
+        self.rate_limited = rate_limited
+        self.retry_after = retry_after
 
-TEMPLATE TO FOLLOW:
+CLINICAL_NOTE_TEMPLATE = """TEMPLATE TO FOLLOW:
 ---
 DENTAL CLINICAL NOTE
 Date: [Date]
@@ -393,7 +1797,12 @@ INSTRUCTIONS:
 8. Fix any typos or informal language from the transcription
 9. Include specific details about tooth numbers, procedures, and findings
 
-Date: {current_time.split(' at ')[0]}
+"""
+
+def build_clinical_note_prompt(transcription, patient_name, dentist_name, current_time):
+    return f"""Task: Convert an informal dental transcription into a formal dental clinical note that follows the exact template and style provided below.
+
+{CLINICAL_NOTE_TEMPLATE}Date: {current_time.split(' at ')[0]}
 Time: {current_time.split(' at ')[1]}
 Patient Name: {patient_name}
 Dentist Name: {dentist_name}
@@ -403,131 +1812,844 @@ Transcription to convert:
 
 Generate the clinical note following the exact template format above."""
 
-        # Multiple free models to try (in order of preference)
-        models_to_try = [
-            {
-                "name": "qwen/qwen3-30b-a3b:free",
-                "description": "Qwen3 30B (Primary - Best Quality)",
-                "max_tokens": 1000,
-                "temperature": 0.7
-            },
-            {
-                "name": "deepseek/deepseek-r1:free", 
-                "description": "DeepSeek R1 (Fallback 1 - Latest)",
-                "max_tokens": 1000,
-                "temperature": 0.6
-            },
-            {
-                "name": "meta-llama/llama-3.3-70b-instruct:free",
-                "description": "Llama 3.3 70B (Fallback 2 - Large)",
-                "max_tokens": 1000,
-                "temperature": 0.7
-            },
-            {
-                "name": "qwen/qwen3-0.6b-04-28:free",
-                "description": "Qwen3 0.6B (Fallback 3 - Fast)",
-                "max_tokens": 800,
-                "temperature": 0.8
-            }
-        ]
+def openrouter_headers(model_name):
+    return {
+        "Authorization": f"Bearer {OPENROUTER_API_KEY}",
+        "Content-Type": "application/json",
+        "HTTP-Referer": "https://depaulhackathon-2025.vercel.app/",
+        "X-Title": "Dental Notes Pro",
+        "X-Model": model_name
+    }
+
+def api_error_message(response):
+    """Describe a non-200 OpenRouter response, including its error body when there is one."""
+    if response.status_code == 503:
+        return "Model temporarily unavailable"
+    error_msg = f"API error {response.status_code}"
+    try:
+        error_data = response.json()
+        if 'error' in error_data:
+            error_msg += f": {error_data['error']}"
+        elif 'message' in error_data:
+            error_msg += f": {error_data['message']}"
+    except:
+        error_msg += f": {response.text}"
+    return error_msg
+
+def request_model_completion(model_config, prompt, timeout, cancel=None):
+    """Run one completion and return its whole content, or raise ModelAttemptError.
+    
+    The completion is streamed, so once the `cancel` event is set the attempt
+    stops at the next chunk and its connection is closed.
+    """
+    logger.info(f"Sending request to OpenRouter API with {model_config['name']} (timeout {timeout:.0f}s)...")
+    content = ''.join(stream_model_completion(model_config, prompt, time.monotonic() + timeout, cancel))
+    if not content or len(content.strip()) <= 50:  # Ensure meaningful content
+        raise ModelAttemptError("Generated content too short or empty")
+    return content
+
+# Client-side rate limiting
+# Each model has a token bucket in Redis shared by every worker, refilled at
+# MODEL_RATE_LIMIT_PER_MINUTE and holding up to MODEL_RATE_LIMIT_BURST requests.
+# A 429 puts the model in a cooldown for its Retry-After period. Attempts are
+# redirected to models with free slots, or wait for the soonest slot.
+MODEL_RATE_LIMIT_PER_MINUTE = float(os.environ.get('MODEL_RATE_LIMIT_PER_MINUTE', 20))
+MODEL_RATE_LIMIT_BURST = int(os.environ.get('MODEL_RATE_LIMIT_BURST', 5))
+MODEL_RATE_LIMIT_COOLDOWN = float(os.environ.get('MODEL_RATE_LIMIT_COOLDOWN', 10))  # used when Retry-After is missing
+
+# Returns 0 if a request slot was taken, otherwise milliseconds until one frees up
+TOKEN_BUCKET_SCRIPT = """
+local cooldown = redis.call('PTTL', KEYS[2])
+if cooldown > 0 then
+    return cooldown
+end
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+local tokens = tonumber(bucket[1]) or capacity
+local updated_at = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated_at) * rate)
+local wait_ms = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait_ms = math.ceil((1 - tokens) / rate * 1000)
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated_at', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate * 1000) + 1000)
+return wait_ms
+"""
+
+lua_scripts = {}
+
+def run_lua_script(script_source, keys, args, client=None):
+    """Run a Lua script with EVALSHA, loading it into Redis on first use.
+    
+    Pass a pipeline as `client` to queue the call instead of running it.
+    """
+    script = lua_scripts.get(script_source)
+    if script is None:
+        script = lua_scripts[script_source] = redis_client.register_script(script_source)
+    return script(keys=keys, args=args, client=client or redis_client)
+
+def parse_retry_after(value):
+    """Parse a Retry-After header given in seconds or as an HTTP date; None if absent or invalid."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+def acquire_model_slot(model_name):
+    """Take a request slot for a model; return 0 on success or the seconds to wait for one."""
+    if not redis_client or MODEL_RATE_LIMIT_PER_MINUTE <= 0:
+        return 0
+    try:
+        wait_ms = run_lua_script(TOKEN_BUCKET_SCRIPT,
+                                 [f"rate_limit:{model_name}", f"rate_limit:{model_name}:cooldown"],
+                                 [MODEL_RATE_LIMIT_BURST, MODEL_RATE_LIMIT_PER_MINUTE / 60])
+        return int(wait_ms) / 1000
+    except Exception as e:
+        logger.error(f"Error checking rate limit for {model_name}: {str(e)}")
+        return 0
+
+def defer_model(model_name, retry_after=None):
+    """Pause all requests to a model after it answered 429."""
+    if not redis_client:
+        return
+    seconds = MODEL_RATE_LIMIT_COOLDOWN if retry_after is None else min(retry_after, 300)
+    if seconds <= 0:
+        return
+    try:
+        redis_client.set(f"rate_limit:{model_name}:cooldown", 1, px=int(seconds * 1000))
+        logger.info(f"Deferring {model_name} for {seconds:.0f}s after rate limit")
+    except Exception as e:
+        logger.error(f"Error deferring {model_name}: {str(e)}")
+
+def next_admitted_model(models, remaining):
+    """Remove and return the first model in `models` with a free rate-limit slot.
+    
+    Returns (model_config, 0), or (None, seconds until the soonest slot) when
+    every model is throttled. Models that cannot free up within `remaining`
+    seconds are dropped from the list.
+    """
+    soonest = None
+    for model_config in list(models):
+        wait_seconds = acquire_model_slot(model_config['name'])
+        if wait_seconds <= 0:
+            models.remove(model_config)
+            return model_config, 0
+        if wait_seconds >= remaining:
+            logger.info(f"Skipping {model_config['name']}: rate limited for {wait_seconds:.1f}s")
+            models.remove(model_config)
+            continue
+        soonest = wait_seconds if soonest is None else min(soonest, wait_seconds)
+    return None, soonest
+
+def admit_note_models(models, deadline):
+    """Yield models one at a time as rate-limit slots allow, waiting when all are throttled."""
+    models = list(models)
+    while models:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        model_config, retry_in = next_admitted_model(models, remaining)
+        if model_config:
+            yield model_config
+        elif retry_in is not None:
+            time.sleep(retry_in)
+
+# Model circuit breakers and routing
+# Each model has a breaker hash and a rolling window of recent outcomes in
+# Redis, shared by every worker. A model that fails MODEL_BREAKER_THRESHOLD
+# times in a row is skipped for MODEL_BREAKER_COOLDOWN seconds, then allowed
+# a single probe request (half-open): the request that claims the probe key
+# routes to the model and every other request skips it until the probe's
+# outcome is recorded. Healthy models are ordered by success rate and latency.
+MODEL_BREAKER_THRESHOLD = int(os.environ.get('MODEL_BREAKER_THRESHOLD', 3))
+MODEL_BREAKER_COOLDOWN = float(os.environ.get('MODEL_BREAKER_COOLDOWN', 60))
+# A probe that never reports back (worker died, attempt cancelled) frees the model after this long
+MODEL_BREAKER_PROBE_TIMEOUT = float(os.environ.get('MODEL_BREAKER_PROBE_TIMEOUT', NOTE_DEADLINE_SECONDS))
+MODEL_STATS_WINDOW = int(os.environ.get('MODEL_STATS_WINDOW', 50))
+
+def record_model_outcome(model_name, success, latency):
+    if not redis_client:
+        return
+    breaker_key = f"model_breaker:{model_name}"
+    try:
+        pipe = redis_client.pipeline()
+        pipe.lpush(f"model_stats:{model_name}", f"{int(success)}:{latency:.3f}")
+        pipe.ltrim(f"model_stats:{model_name}", 0, MODEL_STATS_WINDOW - 1)
+        pipe.delete(f"{breaker_key}:probe")  # Any outcome ends a half-open probe
+        if success:
+            pipe.hset(breaker_key, mapping={'state': 'closed', 'failures': 0})
+        else:
+            pipe.hincrby(breaker_key, 'failures', 1)
+        failures = pipe.execute()[-1]
+        if not success and failures >= MODEL_BREAKER_THRESHOLD:
+            redis_client.hset(breaker_key, mapping={'state': 'open', 'opened_at': time.time()})
+            logger.warning(f"⚠️ Circuit breaker open for {model_name} after {failures} consecutive failures")
+    except Exception as e:
+        logger.error(f"Error recording outcome for {model_name}: {str(e)}")
+
+def get_model_health(models=None):
+    """Return breaker state and rolling success/latency figures for each model, keyed by name."""
+    models = NOTE_MODELS if models is None else models
+    health = {}
+    results = []
+    if redis_client:
+        try:
+            pipe = redis_client.pipeline()
+            for model_config in models:
+                pipe.hgetall(f"model_breaker:{model_config['name']}")
+                pipe.lrange(f"model_stats:{model_config['name']}", 0, -1)
+                pipe.exists(f"model_breaker:{model_config['name']}:probe")
+            results = pipe.execute()
+        except Exception as e:
+            logger.error(f"Error loading model health: {str(e)}")
+            results = []
+    
+    now = time.time()
+    for i, model_config in enumerate(models):
+        breaker = {decode_redis_value(k): decode_redis_value(v) for k, v in (results[3 * i] if results else {}).items()}
+        outcomes = [decode_redis_value(o).split(':') for o in (results[3 * i + 1] if results else [])]
+        successes = sum(1 for ok, _ in outcomes if ok == '1')
+        latencies = [float(latency) for ok, latency in outcomes if ok == '1']
         
-        last_error = None
+        state = breaker.get('state', 'closed')
+        opened_at = float(breaker.get('opened_at', 0))
+        if state == 'open' and now - opened_at >= MODEL_BREAKER_COOLDOWN:
+            state = 'half_open'
         
-        for attempt, model_config in enumerate(models_to_try, 1):
-            try:
-                model_name = model_config["name"]
-                logger.info(f"Attempt {attempt}: Trying {model_config['description']} ({model_name})")
-                
-                headers = {
-                    "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-                    "Content-Type": "application/json",
-                    "HTTP-Referer": "https://depaulhackathon-2025.vercel.app/",
-                    "X-Title": "Dental Notes Pro",
-                    "X-Model": model_name
-                }
-                
-                data = {
-                    "model": model_name,
-                    "messages": [{"role": "user", "content": prompt}],
-                    "max_tokens": model_config["max_tokens"],
-                    "temperature": model_config["temperature"],
-                    "stream": False,
-                    "top_p": 0.9,
-                    "frequency_penalty": 0.1
-                }
-                
-                # Exponential backoff for retries
-                timeout = 45 + (attempt * 15)  # 45s, 60s, 75s, 90s
-                logger.info(f"Using timeout: {timeout}s for attempt {attempt}")
-                
-                logger.info(f"Sending request to OpenRouter API with {model_name}...")
-                
-                # Make the API request
-                response = requests.post(
-                    "https://openrouter.ai/api/v1/chat/completions",
-                    headers=headers,
-                    json=data,
-                    timeout=timeout
-                )
-                
-                logger.info(f"Response status: {response.status_code} for {model_name}")
-                
-                if response.status_code == 200:
-                    try:
-                        result = response.json()
-                        
-                        if result and "choices" in result and len(result["choices"]) > 0:
-                            content = result["choices"][0]["message"]["content"]
-                            if content and len(content.strip()) > 50:  # Ensure meaningful content
-                                logger.info(f"✅ SUCCESS with {model_config['description']}")
-                                logger.info(f"Generated note length: {len(content)} characters")
-                                return content
-                            else:
-                                raise Exception("Generated content too short or empty")
-                        else:
-                            raise Exception("Invalid API response structure")
-                    except json.JSONDecodeError as e:
-                        raise Exception(f"Invalid JSON response: {str(e)}")
-                        
-                elif response.status_code == 429:
-                    logger.warning(f"⚠️ Rate limited on {model_name}, trying next model...")
-                    last_error = "Rate limit exceeded"
+        health[model_config['name']] = {
+            'state': state,
+            'consecutive_failures': int(breaker.get('failures', 0)),
+            'opened_at': opened_at or None,
+            'probe_in_flight': bool(results[3 * i + 2]) if results else False,
+            'samples': len(outcomes),
+            # Smoothed so a model with no history starts at 0.5 rather than 0 or 1
+            'success_rate': (successes + 1) / (len(outcomes) + 2),
+            'avg_latency': sum(latencies) / len(latencies) if latencies else None
+        }
+    return health
+
+def claim_model_probe(model_name):
+    """Claim the single half-open probe for a model; False if another request holds it."""
+    if not redis_client:
+        return True
+    try:
+        return bool(redis_client.set(f"model_breaker:{model_name}:probe", os.getpid(), nx=True,
+                                     px=int(MODEL_BREAKER_PROBE_TIMEOUT * 1000)))
+    except Exception as e:
+        logger.error(f"Error claiming probe for {model_name}: {str(e)}")
+        return False
+
+def release_model_probes(models):
+    """Give back the probes of claimed half-open models that were never attempted."""
+    probe_keys = [f"model_breaker:{m['name']}:probe" for m in models if m.get('probe')]
+    if redis_client and probe_keys:
+        try:
+            redis_client.delete(*probe_keys)
+        except Exception as e:
+            logger.error(f"Error releasing model probes: {str(e)}")
+
+def order_note_models(models=None, health=None, claim_probes=True):
+    """Return the models worth trying, best first, skipping those with open breakers.
+    
+    A half-open model is only included if this call claims its probe; pass
+    claim_probes=False to list the order without claiming (half-open models
+    are then left out). Models are ranked by success rate in steps of 0.1,
+    then by average latency in 10 second steps. Ties keep the configured order.
+    """
+    models = NOTE_MODELS if models is None else models
+    health = get_model_health(models) if health is None else health
+    available = []
+    for model_config in models:
+        state = health[model_config['name']]['state']
+        if state == 'closed':
+            available.append(model_config)
+        elif state == 'half_open' and claim_probes and claim_model_probe(model_config['name']):
+            available.append(dict(model_config, probe=True))
+    
+    def rank(model_config):
+        stats = health[model_config['name']]
+        return (-round(stats['success_rate'], 1), round((stats['avg_latency'] or 0) / 10))
+    
+    return sorted(available, key=rank)
+
+def timed_model_completion(model_config, prompt, timeout, cancel=None):
+    """Run request_model_completion and record its outcome for the circuit breaker.
+    
+    A cancelled attempt says nothing about the model's health: no outcome is
+    recorded and its probe, if it was one, is given back.
+    """
+    started = time.monotonic()
+    try:
+        content = request_model_completion(model_config, prompt, timeout, cancel)
+    except ModelAttemptError as e:
+        if cancel is not None and cancel.is_set():
+            release_model_probes([model_config])
+            raise
+        record_model_outcome(model_config['name'], False, time.monotonic() - started)
+        if e.rate_limited:
+            defer_model(model_config['name'], e.retry_after)
+        raise
+    record_model_outcome(model_config['name'], True, time.monotonic() - started)
+    return content
+
+def race_note_models(prompt, models=None, deadline_seconds=None, hedge_delay=None, deadline=None):
+    """Run a hedged race across the note models and return (content, last_error).
+    
+    The first model starts immediately. Each further model starts when the
+    hedge delay passes without an answer, or as soon as a running attempt
+    fails. The first valid note wins: attempts that have not started are
+    dropped and those in flight are cancelled, closing their connections.
+    All attempts share one deadline budget: an absolute monotonic `deadline`,
+    or `deadline_seconds` from now.
+    """
+    models = list(order_note_models() if models is None else models)
+    unattempted = list(models)
+    hedge_delay = NOTE_HEDGE_DELAY if hedge_delay is None else hedge_delay
+    if deadline is None:
+        deadline = time.monotonic() + (NOTE_DEADLINE_SECONDS if deadline_seconds is None else deadline_seconds)
+    deadline_seconds = max(0, deadline - time.monotonic())
+    if not note_race_slots.acquire(timeout=deadline_seconds):
+        release_model_probes(unattempted)
+        return None, "Too many notes are being generated, please try again"
+    
+    next_start = time.monotonic()
+    pending = {}
+    started = []
+    last_error = None
+    cancel = threading.Event()
+    
+    try:
+        while models or pending:
+            now = time.monotonic()
+            remaining = deadline - now
+            if remaining <= 0:
+                last_error = f"Deadline of {deadline_seconds:.0f}s exceeded"
+                break
+            
+            if models and (not pending or now >= next_start):
+                model_config, retry_in = next_admitted_model(models, remaining)
+                if model_config:
+                    logger.info(f"Starting {model_config['description']} ({model_config['name']})")
+                    future = note_model_executor.submit(timed_model_completion, model_config, prompt, remaining,
+                                                             cancel)
+                    pending[future] = model_config
+                    started.append(future)
+                    unattempted.remove(model_config)
+                    next_start = now + hedge_delay if hedge_delay > 0 else float('inf')
                     continue
-                    
-                elif response.status_code == 503:
-                    logger.warning(f"⚠️ Model {model_name} unavailable, trying next model...")
-                    last_error = "Model temporarily unavailable"
+                # Every remaining model is throttled: wait for the soonest slot
+                last_error = "Rate limit exceeded"
+                next_start = now + retry_in if retry_in is not None else float('inf')
+                if not models and not pending:
+                    break
+            
+            wait_for = min(remaining, max(0, next_start - now)) if models else remaining
+            if not pending:
+                time.sleep(wait_for)
+                continue
+            done, _ = wait(pending, timeout=wait_for, return_when=FIRST_COMPLETED)
+            for future in done:
+                model_config = pending.pop(future)
+                try:
+                    content = future.result()
+                except Exception as e:
+                    logger.warning(f"⚠️ Error with {model_config['name']}: {str(e)}, trying next model...")
+                    last_error = str(e)
+                    next_start = time.monotonic()
                     continue
-                    
+                logger.info(f"✅ SUCCESS with {model_config['description']}")
+                logger.info(f"Generated note length: {len(content)} characters")
+                return content, None
+    finally:
+        # Attempts still queued are dropped; in-flight ones stop at their next chunk
+        cancel.set()
+        for future, model_config in pending.items():
+            if future.cancel():
+                unattempted.append(model_config)
+        release_model_probes(unattempted)
+        release_race_slot_when_done(started)
+    
+    return None, last_error
+
+def release_race_slot_when_done(futures):
+    """Give back a race's slot in note_race_slots once all of its attempts have finished."""
+    if not futures:
+        note_race_slots.release()
+        return
+    lock = threading.Lock()
+    outstanding = [len(futures)]
+    
+    def attempt_done(_):
+        with lock:
+            outstanding[0] -= 1
+            last = outstanding[0] == 0
+        if last:
+            note_race_slots.release()
+    
+    for future in futures:
+        future.add_done_callback(attempt_done)
+
+# Long transcription pipeline
+# Transcriptions longer than NOTE_SEGMENT_THRESHOLD characters are split into
+# overlapping segments at sentence boundaries. Facts for each note section are
+# extracted from every segment concurrently (map), then one merge call writes
+# the templated note from the combined facts (reduce).
+NOTE_SEGMENT_THRESHOLD = int(os.environ.get('NOTE_SEGMENT_THRESHOLD', 6000))
+NOTE_SEGMENT_LENGTH = int(os.environ.get('NOTE_SEGMENT_LENGTH', 3000))
+NOTE_SEGMENT_OVERLAP = int(os.environ.get('NOTE_SEGMENT_OVERLAP', 300))
+NOTE_EXTRACT_SHARE = 0.6  # share of the note deadline the extraction phase may use
+# Segments of one note extracted at once; each runs one model attempt at a time
+# (no hedging), so a long note never holds more model threads than this.
+NOTE_EXTRACT_CONCURRENCY = int(os.environ.get('NOTE_EXTRACT_CONCURRENCY', 2))
+NOTE_EXTRACT_HEARTBEAT = 5  # seconds between progress events while segments are extracted
+note_segment_executor = ThreadPoolExecutor(max_workers=int(os.environ.get('NOTE_SEGMENT_WORKERS', 4)),
+                                           thread_name_prefix='note-segment')
+_SENTENCE_BREAK_RE = re.compile(r'(?<=[.!?])\s+')
+
+def split_transcription_segments(transcription, segment_length=None, overlap=None):
+    """Split a transcription into segments of about segment_length characters.
+    
+    Segments end on sentence boundaries and repeat up to `overlap` characters
+    of trailing sentences from the previous segment, so facts that straddle a
+    boundary are seen whole at least once. Sentences longer than a segment are
+    split on whitespace.
+    """
+    segment_length = NOTE_SEGMENT_LENGTH if segment_length is None else segment_length
+    overlap = NOTE_SEGMENT_OVERLAP if overlap is None else overlap
+    
+    sentences = []
+    for sentence in _SENTENCE_BREAK_RE.split(transcription.strip()):
+        while len(sentence) > segment_length:
+            cut = sentence.rfind(' ', 0, segment_length)
+            cut = cut if cut > 0 else segment_length
+            sentences.append(sentence[:cut])
+            sentence = sentence[cut:].lstrip()
+        if sentence:
+            sentences.append(sentence)
+    
+    segments = []
+    current = []
+    current_length = 0
+    fresh = False  # whether current holds sentences not already in a finished segment
+    for sentence in sentences:
+        if current and fresh and current_length + len(sentence) + 1 > segment_length:
+            segments.append(' '.join(current))
+            carried = []
+            carried_length = 0
+            for previous in reversed(current):
+                if carried_length + len(previous) + 1 > overlap or carried_length + len(previous) + len(sentence) + 2 > segment_length:
+                    break
+                carried.insert(0, previous)
+                carried_length += len(previous) + 1
+            current, current_length = carried, carried_length
+        current.append(sentence)
+        current_length += len(sentence) + 1
+        fresh = True
+    if current and fresh:
+        segments.append(' '.join(current))
+    return segments
+
+def build_segment_facts_prompt(segment, index, count):
+    sections = '\n'.join(f"{section}:" for section in NOTE_SECTIONS)
+    return f"""Task: Extract clinical facts from part {index} of {count} of an informal dental transcription.
+
+List every fact stated in this part under the section it belongs to, one short bullet per fact, using proper dental terminology and tooth numbers. Write "None" under a section with no facts. Do not invent details and do not write a full clinical note. Do NOT use ** or any asterisk formatting.
+
+{sections}
+
+Transcription part {index} of {count}:
+{segment}"""
+
+def build_note_merge_prompt(segment_facts, patient_name, dentist_name, current_time):
+    facts = '\n\n'.join(f"Part {index} of {len(segment_facts)}:\n{facts}" for index, facts in enumerate(segment_facts, 1))
+    return f"""Task: Combine clinical facts extracted from consecutive parts of one dental appointment into a single formal dental clinical note that follows the exact template and style provided below. Neighbouring parts overlap, so merge repeated facts instead of listing them twice.
+
+{CLINICAL_NOTE_TEMPLATE}Date: {current_time.split(' at ')[0]}
+Time: {current_time.split(' at ')[1]}
+Patient Name: {patient_name}
+Dentist Name: {dentist_name}
+
+Extracted facts to combine:
+{facts}
+
+Generate the clinical note following the exact template format above."""
+
+def extract_segment_facts(segments, deadline):
+    """Extract section facts from the segments concurrently, yielding progress events.
+    
+    At most NOTE_EXTRACT_CONCURRENCY segments are in flight, and every
+    extraction shares the absolute monotonic `deadline`; segments still
+    running or queued when it passes are abandoned. Yields ('progress', ...)
+    events as segments finish and at least every NOTE_EXTRACT_HEARTBEAT
+    seconds. A segment whose extraction failed is passed on as raw text so the
+    merge call still sees it. Returns the facts in order, or None if every
+    extraction failed.
+    """
+    queued = list(enumerate(segments))
+    running = {}
+    facts_by_index = {}
+    
+    def submit_next():
+        index, segment = queued.pop(0)
+        future = note_segment_executor.submit(race_note_models,
+                                              build_segment_facts_prompt(segment, index + 1, len(segments)),
+                                              hedge_delay=0, deadline=deadline)
+        running[future] = index
+    
+    try:
+        while (queued or running) and time.monotonic() < deadline:
+            while queued and len(running) < NOTE_EXTRACT_CONCURRENCY:
+                submit_next()
+            timeout = min(NOTE_EXTRACT_HEARTBEAT, max(0, deadline - time.monotonic()))
+            done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = running.pop(future)
+                try:
+                    facts, last_error = future.result()
+                except Exception as e:
+                    facts, last_error = None, str(e)
+                if facts:
+                    facts_by_index[index] = facts.strip()
                 else:
-                    error_msg = f"API error {response.status_code}"
-                    try:
-                        error_data = response.json()
-                        if 'error' in error_data:
-                            error_msg += f": {error_data['error']}"
-                        elif 'message' in error_data:
-                            error_msg += f": {error_data['message']}"
-                    except:
-                        error_msg += f": {response.text}"
-                    
-                    logger.warning(f"⚠️ Error with {model_name}: {error_msg}")
-                    last_error = error_msg
+                    logger.warning(f"⚠️ Fact extraction failed for segment {index + 1}: {last_error}")
+            yield ('progress', {'stage': 'extracting', 'segments': len(segments),
+                                'extracted': len(facts_by_index), 'pending': len(queued) + len(running)})
+    finally:
+        for future in running:
+            future.cancel()
+    
+    if queued or running:
+        logger.warning(f"⚠️ Extraction deadline reached with {len(queued) + len(running)} segments unfinished")
+    logger.info(f"Extracted facts from {len(facts_by_index)}/{len(segments)} segments")
+    if not facts_by_index:
+        return None
+    return [facts_by_index.get(index, f"(raw transcription)\n{segment}") for index, segment in enumerate(segments)]
+
+def iter_note_prompt(transcription, patient_name, dentist_name, current_time, deadline):
+    """Build the prompt for the final note call, yielding extraction progress for long transcriptions.
+    
+    Returns (via StopIteration) the prompt, or None if the transcription is
+    long and no segment could be extracted in time. Extraction may use
+    NOTE_EXTRACT_SHARE of the time left before `deadline`.
+    """
+    if len(transcription) <= NOTE_SEGMENT_THRESHOLD:
+        return build_clinical_note_prompt(transcription, patient_name, dentist_name, current_time)
+    
+    segments = split_transcription_segments(transcription)
+    logger.info(f"📚 Long transcription ({len(transcription)} characters): extracting facts from {len(segments)} segments")
+    extract_deadline = time.monotonic() + max(0, deadline - time.monotonic()) * NOTE_EXTRACT_SHARE
+    segment_facts = yield from extract_segment_facts(segments, extract_deadline)
+    if not segment_facts:
+        return None
+    return build_note_merge_prompt(segment_facts, patient_name, dentist_name, current_time)
+
+def prepare_note_prompt(transcription, patient_name, dentist_name, current_time, deadline):
+    """Return the prompt for the final note call; see iter_note_prompt."""
+    events = iter_note_prompt(transcription, patient_name, dentist_name, current_time, deadline)
+    while True:
+        try:
+            next(events)
+        except StopIteration as finished:
+            return finished.value
+
+# Generated note cache
+# Notes are cached under a hash of everything that shapes the prompt. Bump
+# NOTE_PROMPT_VERSION whenever build_clinical_note_prompt changes.
+NOTE_PROMPT_VERSION = 1
+NOTE_CACHE_TTL = int(os.environ.get('NOTE_CACHE_TTL', 86400))
+NOTE_CACHE_MAX_ENTRIES = int(os.environ.get('NOTE_CACHE_MAX_ENTRIES', 1000))  # 0 disables the cache
+NOTE_CACHE_INDEX_KEY = 'note_cache:index'
+
+def note_cache_key(transcription, patient_name, dentist_name, current_time):
+    normalised = ' '.join(transcription.split())
+    note_date = current_time.split(' at ')[0]
+    material = json.dumps([NOTE_PROMPT_VERSION, normalised, patient_name, dentist_name, note_date])
+    return f"note_cache:{hashlib.sha256(material.encode('utf-8')).hexdigest()}"
+
+def get_cached_note(cache_key):
+    if not redis_client or NOTE_CACHE_MAX_ENTRIES <= 0:
+        return None
+    try:
+        cached = redis_client.get(cache_key)
+        return decode_redis_value(cached) if cached else None
+    except Exception as e:
+        logger.error(f"Error reading note cache: {str(e)}")
+        return None
+
+def cache_generated_note(cache_key, content):
+    """Store a generated note, evicting the oldest entries beyond NOTE_CACHE_MAX_ENTRIES."""
+    if not redis_client or NOTE_CACHE_MAX_ENTRIES <= 0:
+        return
+    try:
+        now = time.time()
+        pipe = redis_client.pipeline()
+        pipe.set(cache_key, content, ex=NOTE_CACHE_TTL)
+        pipe.zadd(NOTE_CACHE_INDEX_KEY, {cache_key: now})
+        pipe.zremrangebyscore(NOTE_CACHE_INDEX_KEY, '-inf', now - NOTE_CACHE_TTL)
+        pipe.zcard(NOTE_CACHE_INDEX_KEY)
+        cached_count = pipe.execute()[-1]
+        if cached_count > NOTE_CACHE_MAX_ENTRIES:
+            evicted = redis_client.zpopmin(NOTE_CACHE_INDEX_KEY, cached_count - NOTE_CACHE_MAX_ENTRIES)
+            if evicted:
+                redis_client.delete(*[decode_redis_value(key) for key, _ in evicted])
+    except Exception as e:
+        logger.error(f"Error writing note cache: {str(e)}")
+
+def wants_note_cache_bypass(data=None):
+    """True if the request asks for a fresh note via `bypass_cache` or Cache-Control: no-cache."""
+    if data and data.get('bypass_cache'):
+        return True
+    return has_request_context() and 'no-cache' in request.headers.get('Cache-Control', '')
+
+# Streaming note generation
+NOTE_SECTIONS = ('CHIEF COMPLAINT', 'CLINICAL FINDINGS', 'TREATMENT PROVIDED', 'MEDICATIONS', 'FOLLOW-UP')
+# Longest gap allowed between streamed chunks before a model is abandoned
+NOTE_STREAM_IDLE_TIMEOUT = float(os.environ.get('NOTE_STREAM_IDLE_TIMEOUT', 30))
+
+def stream_model_completion(model_config, prompt, deadline, cancel=None):
+    """Yield content deltas from a streaming completion, or raise ModelAttemptError.
+    
+    Setting the optional `cancel` event abandons the stream at its next line.
+    """
+    model_name = model_config["name"]
+    data = {
+        "model": model_name,
+        "messages": [{"role": "user", "content": prompt}],
+        "max_tokens": model_config["max_tokens"],
+        "temperature": model_config["temperature"],
+        "stream": True,
+        "top_p": 0.9,
+        "frequency_penalty": 0.1
+    }
+    
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise ModelAttemptError("Deadline exceeded")
+    
+    logger.info(f"Opening streaming request to OpenRouter API with {model_name}...")
+    try:
+        response = openrouter_session.post(OPENROUTER_API_URL, headers=openrouter_headers(model_name), json=data,
+                                           stream=True, timeout=(min(OPENROUTER_CONNECT_TIMEOUT, remaining),
+                                                                 min(remaining, NOTE_STREAM_IDLE_TIMEOUT)))
+    except requests.exceptions.Timeout:
+        raise ModelAttemptError("Timeout waiting for stream to start")
+    except requests.exceptions.RequestException as e:
+        raise ModelAttemptError(f"Network error: {str(e)}")
+    
+    with response:
+        if response.status_code == 429:
+            raise ModelAttemptError("Rate limit exceeded", rate_limited=True,
+                                    retry_after=parse_retry_after(response.headers.get('Retry-After')))
+        if response.status_code != 200:
+            raise ModelAttemptError(api_error_message(response))
+        try:
+            for line in response.iter_lines(decode_unicode=True):
+                if cancel is not None and cancel.is_set():
+                    raise ModelAttemptError("Cancelled")
+                if time.monotonic() > deadline:
+                    raise ModelAttemptError("Deadline exceeded while streaming")
+                # Skip blank keep-alive lines and ": OPENROUTER PROCESSING" comments
+                if not line or not line.startswith('data:'):
                     continue
-                    
-            except requests.exceptions.Timeout:
-                logger.warning(f"⚠️ Timeout with {model_name} after {timeout}s, trying next model...")
-                last_error = f"Timeout after {timeout}s"
-                continue
-                
-            except requests.exceptions.RequestException as e:
-                logger.warning(f"⚠️ Network error with {model_name}: {str(e)}, trying next model...")
-                last_error = f"Network error: {str(e)}"
-                continue
-                
-            except Exception as e:
-                logger.warning(f"⚠️ Error with {model_name}: {str(e)}, trying next model...")
+                payload = line[5:].strip()
+                if payload == '[DONE]':
+                    return
+                try:
+                    chunk = json.loads(payload)
+                except ValueError:
+                    continue
+                if 'error' in chunk:
+                    raise ModelAttemptError(f"Stream error: {chunk['error']}")
+                choices = chunk.get('choices') or [{}]
+                text = (choices[0].get('delta') or {}).get('content')
+                if text:
+                    yield text
+        except requests.exceptions.RequestException as e:
+            raise ModelAttemptError(f"Stream interrupted: {str(e)}")
+
+class NoteSectionAssembler:
+    """Accumulate streamed note text and report each section once its text is complete.
+    
+    A section is complete when the next heading or the closing "Note:" line
+    arrives, or when the text ends.
+    """
+    
+    def __init__(self):
+        self.text = ''
+        self.sections = {}
+        self._current = None
+        self._line_start = 0
+    
+    def feed(self, delta):
+        """Append a delta and return the names of sections it completed."""
+        self.text += delta
+        completed = []
+        while True:
+            newline = self.text.find('\n', self._line_start)
+            if newline == -1:
+                return completed
+            self._finish_line(self.text[self._line_start:newline], completed)
+            self._line_start = newline + 1
+    
+    def finish(self):
+        self.flush()
+        return self.text
+    
+    def flush(self):
+        """End the text and return the names of the sections that completes."""
+        completed = []
+        if self._line_start < len(self.text):
+            self._finish_line(self.text[self._line_start:], completed)
+            self._line_start = len(self.text)
+        if self._current:
+            completed.append(self._current)
+            self._current = None
+        return completed
+    
+    def section_events(self, names):
+        return [('section', {'name': name, 'text': self.sections[name]}) for name in names]
+    
+    def _finish_line(self, line, completed):
+        heading = line.strip().rstrip(':').strip().upper()
+        if heading in NOTE_SECTIONS:
+            if self._current:
+                completed.append(self._current)
+            self._current = heading
+            self.sections[heading] = ''
+        elif line.strip().startswith('Note:'):
+            if self._current:
+                completed.append(self._current)
+            self._current = None  # Closing disclaimer is not part of any section
+        elif self._current:
+            self.sections[self._current] = (self.sections[self._current] + '\n' + line).strip()
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def stream_clinical_note(transcription, patient_name, dentist_name, use_cache=True):
+    """Yield (event, data) pairs while generating a note, trying the models in order.
+    
+    Emits `progress` events while a long transcription's segments are
+    extracted, `delta` events with new text, a `section` event with each
+    section's name and text once it is complete, `reset` when a model fails
+    mid-stream and the next one starts over, and a final `done` event with
+    the assembled note.
+    """
+    current_time = datetime.now().strftime("%B %d, %Y at %I:%M %p")
+    deadline = time.monotonic() + NOTE_DEADLINE_SECONDS
+    last_error = "OpenRouter API key not configured"
+    cache_key = note_cache_key(transcription, patient_name, dentist_name, current_time)
+    
+    cached = get_cached_note(cache_key) if use_cache else None
+    if cached:
+        logger.info("Serving streamed note from generation cache")
+        assembler = NoteSectionAssembler()
+        yield ('delta', {'text': cached})
+        yield from assembler.section_events(assembler.feed(cached) + assembler.flush())
+        yield ('done', {'clinical_record': assembler.text, 'sections': assembler.sections,
+                        'model': None, 'fallback': False, 'cached': True})
+        return
+    
+    prompt = None
+    if OPENROUTER_API_KEY:
+        prompt = yield from iter_note_prompt(transcription, patient_name, dentist_name, current_time, deadline)
+        if not prompt:
+            last_error = "Fact extraction failed for every segment"
+    # Claimed half-open probes are released if their model is never tried
+    models = order_note_models() if prompt else []
+    unattempted = list(models)
+    try:
+        for model_config in admit_note_models(models, deadline):
+            unattempted.remove(model_config)
+            assembler = NoteSectionAssembler()
+            started = time.monotonic()
+            try:
+                for delta in stream_model_completion(model_config, prompt, deadline):
+                    yield ('delta', {'text': delta})
+                    yield from assembler.section_events(assembler.feed(delta))
+                completed = assembler.flush()
+                content = assembler.text
+                if len(content.strip()) <= 50:
+                    raise ModelAttemptError("Generated content too short or empty")
+                yield from assembler.section_events(completed)
+                logger.info(f"✅ Streamed note with {model_config['description']} ({len(content)} characters)")
+                record_model_outcome(model_config['name'], True, time.monotonic() - started)
+                cache_generated_note(cache_key, content)
+                yield ('done', {'clinical_record': content, 'sections': assembler.sections,
+                                'model': model_config['name'], 'fallback': False})
+                return
+            except ModelAttemptError as e:
+                logger.warning(f"⚠️ Streaming error with {model_config['name']}: {str(e)}, trying next model...")
+                record_model_outcome(model_config['name'], False, time.monotonic() - started)
+                if e.rate_limited:
+                    defer_model(model_config['name'], e.retry_after)
                 last_error = str(e)
-                continue
+                if assembler.text:
+                    yield ('reset', {'reason': last_error})
+    finally:
+        release_model_probes(unattempted)
+    
+    logger.error(f"❌ All AI models failed while streaming. Last error: {last_error}")
+    content = generate_enhanced_fallback_note(transcription, patient_name, dentist_name, current_time)
+    assembler = NoteSectionAssembler()
+    yield ('delta', {'text': content})
+    yield from assembler.section_events(assembler.feed(content) + assembler.flush())
+    yield ('done', {'clinical_record': content, 'sections': assembler.sections, 'model': None, 'fallback': True})
+
+def get_current_dentist_name():
+    dentist_id = get_current_dentist_id() if has_request_context() else None
+    dentist = get_dentist_from_kv(dentist_id) if dentist_id else None
+    return dentist.get('name', 'Doctor') if dentist else 'Doctor'
+
+def generate_clinical_note(transcription, patient_name, dentist_name=None, use_cache=True):
+    """Generate a clinical note by racing the AI models within a deadline budget.
+    
+    AI-generated notes are cached; pass use_cache=False to force a fresh note.
+    """
+    try:
+        logger.info(f"Starting clinical note generation for patient: {patient_name}")
+        logger.info(f"Transcription length: {len(transcription)}")
+        
+        if not OPENROUTER_API_KEY:
+            logger.error("OpenRouter API key not found in environment variables")
+            return generate_basic_note(transcription, patient_name)
+
+        # Get dentist name from current dentist
+        if dentist_name is None:
+            dentist_name = get_current_dentist_name()
+
+        # Get current timestamp for the clinical note
+        current_time = datetime.now().strftime("%B %d, %Y at %I:%M %p")
+        logger.info(f"Using timestamp: {current_time}")
+
+        cache_key = note_cache_key(transcription, patient_name, dentist_name, current_time)
+        if use_cache:
+            cached = get_cached_note(cache_key)
+            if cached:
+                logger.info("Serving note from generation cache")
+                return cached
+
+        deadline = time.monotonic() + NOTE_DEADLINE_SECONDS
+        prompt = prepare_note_prompt(transcription, patient_name, dentist_name, current_time, deadline)
+        if prompt:
+            content, last_error = race_note_models(prompt, deadline=deadline)
+        else:
+            content, last_error = None, "Fact extraction failed for every segment"
+        if content:
+            cache_generated_note(cache_key, content)
+            return content
         
         # If all models failed, log the issue and return enhanced fallback
         logger.error(f"❌ All AI models failed. Last error: {last_error}")
@@ -539,6 +2661,139 @@ Generate the clinical note following the exact template format above."""
         logger.error(traceback.format_exc())
         return generate_basic_note(transcription, patient_name)
 
+# Dental term extraction
+# Vocabulary terms are matched as substrings of the lower-cased transcription
+# (so "exam" also matches "examination") with an Aho-Corasick automaton, which
+# finds every term in a single pass however large the vocabulary grows.
+DEFAULT_DENTAL_TERMS = {
+    'procedures': ['cleaning', 'filling', 'extraction', 'crown', 'root canal', 'scaling', 'polishing', 'exam', 'x-ray'],
+    'conditions': ['cavity', 'decay', 'tartar', 'plaque', 'gingivitis', 'inflammation', 'sensitivity', 'pain'],
+    'medications': ['fluoride', 'antibiotic', 'ibuprofen', 'acetaminophen', 'rinse', 'prescription']
+}
+DENTAL_TERMS_PATH = os.environ.get('DENTAL_TERMS_PATH')  # JSON file of {category: [terms]} added to the defaults
+TOOTH_NUMBER_RANGE = range(1, 33)  # universal numbering
+# Quantities that can follow a tooth ("tooth 14, 3 times daily") and end a list
+_TOOTH_LIST_STOP_WORDS = r'(?:times|x\b|mm|millimet|mg|ml|days?|weeks?|months?|hours?|minutes?|years?)'
+# "tooth"/"teeth" may head a list ("teeth 3, 14 and #30"); a bare "#" covers one tooth
+_TOOTH_REFERENCE_RE = re.compile(
+    r'#\s*\d{1,2}(?!\d)'
+    r'|\b(?:tooth|teeth)\s+(?:number\s+|no\.?\s*|#\s*)?\d{1,2}(?!\d)'
+    r'(?:\s*(?:(?:,\s*)+(?:and\s+|&\s*)?|and\s+|&\s*)#?\s*\d{1,2}(?!\d|\s*,*\s*' + _TOOTH_LIST_STOP_WORDS + r'))*',
+    re.IGNORECASE
+)
+_TOOTH_LIST_NUMBER_RE = re.compile(r'\d{1,2}')
+
+TermMatch = namedtuple('TermMatch', ['category', 'term', 'start', 'end'])
+
+class DentalTermMatcher:
+    """Aho-Corasick automaton over a {category: [terms]} vocabulary."""
+
+    def __init__(self, vocabulary):
+        self.vocabulary = {category: [] for category in vocabulary}
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]
+        for category, terms in vocabulary.items():
+            for term in terms:
+                term = ' '.join(str(term).lower().split())
+                if term and term not in self.vocabulary[category]:
+                    self.vocabulary[category].append(term)
+                    self._add(category, term)
+        self._link()
+
+    def _add(self, category, term):
+        node = 0
+        for char in term:
+            if char not in self._goto[node]:
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+                self._goto[node][char] = len(self._goto) - 1
+            node = self._goto[node][char]
+        self._output[node].append((category, term))
+
+    def _link(self):
+        # Breadth-first so every fail link points at an already linked node
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fallback = self._fail[node]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[child] = self._goto[fallback].get(char, 0)
+                self._output[child] = self._output[child] + self._output[self._fail[child]]
+
+    def find_all(self, text):
+        """Return a TermMatch for every vocabulary term in text, with offsets into text."""
+        matches = []
+        node = 0
+        positions = []  # lower-cased position -> index in the original text
+        for index, original in enumerate(text or ''):
+            for char in original.lower():
+                positions.append(index)
+                while node and char not in self._goto[node]:
+                    node = self._fail[node]
+                node = self._goto[node].get(char, 0)
+                for category, term in self._output[node]:
+                    start = positions[len(positions) - len(term)]
+                    matches.append(TermMatch(category, term, start, index + 1))
+        return matches
+
+def load_dental_vocabulary(path=None):
+    """Return the default dental vocabulary extended with terms from a JSON file, if configured."""
+    vocabulary = {category: list(terms) for category, terms in DEFAULT_DENTAL_TERMS.items()}
+    path = path or DENTAL_TERMS_PATH
+    if not path:
+        return vocabulary
+    try:
+        with open(path, encoding='utf-8') as handle:
+            extra = json.load(handle)
+        for category, terms in extra.items():
+            vocabulary.setdefault(category, []).extend(terms)
+        logger.info(f"📚 Loaded dental vocabulary from {path}")
+    except Exception as e:
+        logger.error(f"Error loading dental vocabulary from {path}: {str(e)}")
+    return vocabulary
+
+dental_term_matcher = None
+dental_term_matcher_lock = threading.Lock()
+
+def get_dental_term_matcher():
+    """Build the term automaton on first use and share it across requests."""
+    global dental_term_matcher
+    if dental_term_matcher is None:
+        with dental_term_matcher_lock:
+            if dental_term_matcher is None:
+                dental_term_matcher = DentalTermMatcher(load_dental_vocabulary())
+    return dental_term_matcher
+
+def extract_tooth_numbers(text):
+    """Return TermMatch entries for tooth references such as "#14", "tooth 3" or "teeth 3 and 14" (1-32 only)."""
+    matches = []
+    for reference in _TOOTH_REFERENCE_RE.finditer(text or ''):
+        # Each number in a list gets its own span; the first also covers the prefix
+        for position, number in enumerate(_TOOTH_LIST_NUMBER_RE.finditer(text, reference.start(), reference.end())):
+            if int(number.group()) in TOOTH_NUMBER_RANGE:
+                start = reference.start() if position == 0 else number.start()
+                matches.append(TermMatch('teeth', str(int(number.group())), start, number.end()))
+    return matches
+
+def extract_dental_terms(text):
+    """Return all vocabulary and tooth-number matches in text, ordered by position."""
+    matches = get_dental_term_matcher().find_all(text) + extract_tooth_numbers(text)
+    return sorted(matches, key=lambda match: (match.start, -match.end))
+
+def group_dental_terms(matches):
+    """Group matches into {category: [terms]}, without duplicates, in order of first mention."""
+    grouped = {}
+    for match in matches:
+        terms = grouped.setdefault(match.category, [])
+        if match.term not in terms:
+            terms.append(match.term)
+    return grouped
+
 def generate_enhanced_fallback_note(transcription, patient_name, dentist_name, current_time):
     """Generate an enhanced fallback note when AI models fail"""
     logger.info("Generating enhanced fallback clinical note")
@@ -546,32 +2801,12 @@ def generate_enhanced_fallback_note(transcription, patient_name, dentist_name, c
     # Enhanced processing of transcription
     processed_transcription = process_speech_text(transcription)
     
-    # Extract key dental information
-    tooth_numbers = re.findall(r'#?\s*(\d{1,2})', processed_transcription)
-    procedures = []
-    findings = []
-    medications = []
-    
-    # Common dental terms detection
-    dental_terms = {
-        'procedures': ['cleaning', 'filling', 'extraction', 'crown', 'root canal', 'scaling', 'polishing', 'exam', 'x-ray'],
-        'conditions': ['cavity', 'decay', 'tartar', 'plaque', 'gingivitis', 'inflammation', 'sensitivity', 'pain'],
-        'medications': ['fluoride', 'antibiotic', 'ibuprofen', 'acetaminophen', 'rinse', 'prescription']
-    }
-    
-    processed_lower = processed_transcription.lower()
-    
-    for term in dental_terms['procedures']:
-        if term in processed_lower:
-            procedures.append(term.title())
-    
-    for term in dental_terms['conditions']:
-        if term in processed_lower:
-            findings.append(term.title())
-    
-    for term in dental_terms['medications']:
-        if term in processed_lower:
-            medications.append(term.title())
+    # Extract key dental information in one pass over the transcription
+    found_terms = group_dental_terms(extract_dental_terms(processed_transcription))
+    tooth_numbers = found_terms.get('teeth', [])
+    procedures = [term.title() for term in found_terms.get('procedures', [])]
+    findings = [term.title() for term in found_terms.get('conditions', [])]
+    medications = [term.title() for term in found_terms.get('medications', [])]
     
     # Build the clinical note
     note_content = f"""DENTAL CLINICAL NOTE
@@ -621,25 +2856,330 @@ None documented.
 
 Note: This clinical note was generated with AI assistance. Please verify all information for accuracy."""
 
-def init_session():
-    """Initialize session data with defaults"""
-    session_data = get_session()
+# Note generation jobs
+# A job records one note generation in Redis so a reloaded page can resume it.
+# Jobs run on note_job_executor, which needs a long-lived server process; SSE
+# viewers (/api/note-jobs/<id>/stream) only tail the partial text, which is
+# appended to note_job:{id}:partial rather than stored in the job record, so
+# no web worker is held for the model call. Whoever runs a job holds its
+# runner lease (note_job:{id}:runner). Serverless hosts freeze threads once a
+# response is sent, so there NOTE_JOB_INLINE=1 makes jobs wait for a viewer,
+# which then generates the note inside its own SSE request.
+NOTE_JOB_INLINE = os.environ.get('NOTE_JOB_INLINE', '').lower() in ('1', 'true', 'yes')
+NOTE_JOB_TTL = int(os.environ.get('NOTE_JOB_TTL', 3600))
+NOTE_JOB_PROGRESS_INTERVAL = float(os.environ.get('NOTE_JOB_PROGRESS_INTERVAL', 0.5))
+NOTE_JOB_LEASE = int(os.environ.get('NOTE_JOB_LEASE', 30))  # seconds a runner may go without reporting
+NOTE_JOB_TAIL_INTERVAL = 0.5  # seconds between polls when following another runner's job
+# Queued or running jobs nobody holds the lease for are reported as interrupted after this long
+NOTE_JOB_STALE_AFTER = NOTE_DEADLINE_SECONDS + 60
+note_job_executor = ThreadPoolExecutor(max_workers=int(os.environ.get('NOTE_JOB_WORKERS', 4)),
+                                       thread_name_prefix='note-job')
+
+def save_note_job(job):
+    job['updated_at'] = time.time()
+    record = {key: value for key, value in job.items() if key != 'partial'}
+    redis_client.set(f"note_job:{job['id']}", json.dumps(record), ex=NOTE_JOB_TTL)
+
+def get_note_job(job_id, dentist_id=None):
+    """Load a job with its partial text, marking it failed if nobody is running it any more."""
+    if not redis_client:
+        return None
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.get(f"note_job:{job_id}")
+    pipe.get(f"note_job:{job_id}:partial")
+    pipe.exists(f"note_job:{job_id}:runner")
+    job_data, partial, has_runner = pipe.execute()
+    if not job_data:
+        return None
+    try:
+        job = json.loads(job_data)
+    except ValueError:
+        return None
+    if dentist_id and job.get('dentist_id') != dentist_id:
+        return None
+    job['partial'] = (decode_redis_value(partial) or '') if job['status'] in ('queued', 'running') else ''
+    if (job['status'] in ('queued', 'running') and not has_runner
+            and time.time() - job['updated_at'] > NOTE_JOB_STALE_AFTER):
+        job['status'] = 'failed'
+        job['error'] = 'Note generation was interrupted, please try again'
+    return job
+
+def claim_note_job(job_id, dentist_id=None):
+    """Take the runner lease for an unfinished job and return it, or None if someone else holds it."""
+    runner_key = f"note_job:{job_id}:runner"
+    if not redis_client.set(runner_key, os.getpid(), nx=True, ex=NOTE_JOB_LEASE):
+        return None
+    # Re-read under the lease: the previous runner may have finished in the meantime
+    job = get_note_job(job_id, dentist_id)
+    if job and job['status'] in ('queued', 'running'):
+        return job
+    redis_client.delete(runner_key)
+    return None
+
+def run_note_job(job, patient_name, dentist_name):
+    """Generate the note for a job whose lease is held, yielding the stream events.
+    
+    The partial text is appended to Redis (and the lease renewed) at most every
+    NOTE_JOB_PROGRESS_INTERVAL seconds. If the consumer goes away mid-stream the
+    lease is released, so the next viewer restarts the job straight away.
+    """
+    partial_key = f"note_job:{job['id']}:partial"
+    runner_key = f"note_job:{job['id']}:runner"
+    job.update(status='running', error=None)
+    save_note_job(job)
+    redis_client.delete(partial_key)
+    pending = ''
+    last_progress = time.monotonic()
+    try:
+        for event, event_data in stream_clinical_note(job['transcription'], patient_name, dentist_name,
+                                                      job.get('use_cache', True)):
+            pipe = None
+            if event == 'delta':
+                pending += event_data['text']
+            elif event == 'reset':
+                pending = ''
+                pipe = redis_client.pipeline(transaction=False)
+                pipe.delete(partial_key)
+            elif event == 'done':
+                job.update(status='completed', clinical_record=event_data['clinical_record'],
+                           fallback=event_data['fallback'])
+            if event != 'done' and (pipe or time.monotonic() - last_progress >= NOTE_JOB_PROGRESS_INTERVAL):
+                pipe = pipe or redis_client.pipeline(transaction=False)
+                if pending:
+                    pipe.append(partial_key, pending)
+                    pipe.expire(partial_key, NOTE_JOB_TTL)
+                    pending = ''
+                pipe.expire(runner_key, NOTE_JOB_LEASE)
+                pipe.execute()
+                last_progress = time.monotonic()
+            yield event, event_data
+            if event == 'done':
+                break
+        if job['status'] != 'completed':
+            job.update(status='failed', error='Note generation ended without a result')
+    except GeneratorExit:
+        logger.info(f"Note job {job['id']} lost its viewer, releasing it")
+        redis_client.delete(runner_key)
+        raise
+    except Exception as e:
+        logger.error(f"Error in note job {job['id']}: {str(e)}")
+        logger.error(traceback.format_exc())
+        job.update(status='failed', error=f'Clinical note generation failed: {str(e)}')
+        yield 'error', {'error': job['error']}
+    try:
+        save_note_job(job)
+        redis_client.delete(partial_key, runner_key)
+    except Exception as e:
+        logger.error(f"Error saving note job {job['id']}: {str(e)}")
+
+def run_note_job_in_background(job_id, patient_name, dentist_name):
+    job = claim_note_job(job_id)
+    if not job:
+        return  # Already running elsewhere or finished
+    for _ in run_note_job(job, patient_name, dentist_name):
+        pass
+
+def follow_note_job(job_id, dentist_id, patient_name, dentist_name):
+    """Yield a job's stream events by tailing its partial text and status.
     
-    # Set defaults if not present
-    if 'patients' not in session_data:
-        session_data['patients'] = {}
-    if 'recent_patients' not in session_data:
-        session_data['recent_patients'] = []
-    if 'current_patient' not in session_data:
-        session_data['current_patient'] = None
-    if 'current_note_data' not in session_data:
-        session_data['current_note_data'] = None
-    if 'dentist_name' not in session_data:
-        session_data['dentist_name'] = 'Doctor'
-    
-    # Update session with defaults
-    session_id, session_response = update_session(session_data)
-    return session_data, session_id
+    A job nobody holds the lease for (its process went away) is restarted on
+    the executor, or run in this request when NOTE_JOB_INLINE is set.
+    """
+    offset = 0
+    waited_since = time.monotonic()
+    resubmitted = False
+    assembler = NoteSectionAssembler()
+    while True:
+        job = get_note_job(job_id, dentist_id)
+        if not job:
+            yield 'error', {'error': 'Job not found'}
+            return
+        if job['status'] == 'completed':
+            # Relay whatever the last progress write did not cover, then close the sections
+            record = job['clinical_record'] or ''
+            if record.startswith(assembler.text) and len(record) > offset:
+                yield 'delta', {'text': record[offset:]}
+                yield from assembler.section_events(assembler.feed(record[offset:]))
+            yield from assembler.section_events(assembler.flush())
+            yield 'done', {'clinical_record': record, 'sections': assembler.sections,
+                           'model': None, 'fallback': job.get('fallback', False)}
+            return
+        if job['status'] == 'failed':
+            yield 'error', {'error': job['error']}
+            return
+        if NOTE_JOB_INLINE:
+            claimed = claim_note_job(job_id, dentist_id)
+            if claimed:
+                if offset:
+                    yield 'reset', {'reason': 'Restarting interrupted note generation'}
+                yield from run_note_job(claimed, patient_name, dentist_name)
+                return
+        elif (not resubmitted and time.time() - job['updated_at'] > NOTE_JOB_LEASE
+              and not redis_client.exists(f"note_job:{job_id}:runner")):
+            logger.info(f"Note job {job_id} has no runner, resubmitting it")
+            note_job_executor.submit(run_note_job_in_background, job_id, patient_name, dentist_name)
+            resubmitted = True
+        # Relay the runner's text as it is appended
+        partial = job['partial']
+        if len(partial) < offset:
+            yield 'reset', {'reason': 'The model was restarted'}
+            offset = 0
+            assembler = NoteSectionAssembler()
+        if len(partial) > offset:
+            yield 'delta', {'text': partial[offset:]}
+            yield from assembler.section_events(assembler.feed(partial[offset:]))
+            offset = len(partial)
+            waited_since = time.monotonic()
+        elif time.monotonic() - waited_since > NOTE_JOB_STALE_AFTER:
+            yield 'error', {'error': 'Note generation is not making progress, please try again'}
+            return
+        time.sleep(NOTE_JOB_TAIL_INTERVAL)
+
+def submit_note_job(dentist_id, patient, transcription, use_cache=True):
+    """Record note generation for a patient, queue it and return the new job record.
+    
+    With NOTE_JOB_INLINE set the job is not queued; it waits for a viewer of its stream to run it.
+    """
+    job = {
+        'id': str(uuid.uuid4()),
+        'status': 'queued',
+        'dentist_id': dentist_id,
+        'patient_id': patient['id'],
+        'transcription': transcription,
+        'use_cache': use_cache,
+        'clinical_record': None,
+        'error': None,
+        'created_at': datetime.now().isoformat()
+    }
+    save_note_job(job)
+    job['partial'] = ''
+    if not NOTE_JOB_INLINE:
+        note_job_executor.submit(run_note_job_in_background, job['id'], patient.get('name', 'Patient'),
+                                 get_current_dentist_name())
+    logger.info(f"Queued note job {job['id']} for patient {patient['id']}")
+    return job
+
+def note_job_response(job):
+    return {key: job.get(key) for key in ('id', 'status', 'patient_id', 'partial', 'clinical_record', 'error', 'created_at')}
+
+# Server-side transcription
+# Uploaded audio is spooled to a temporary file in fixed-size blocks, so
+# memory use does not grow with recording length. Uploads that declare a
+# larger Content-Length are refused before the body is read, and chunked
+# multipart bodies stop parsing at the limit. AUDIO_MAX_CONCURRENT_UPLOADS
+# bounds how many uploads are spooled or transcribed at once, and a fixed
+# worker pool runs the configured TranscriptionEngine.
+AUDIO_MAX_UPLOAD_BYTES = int(os.environ.get('AUDIO_MAX_UPLOAD_BYTES', 50 * 1024 * 1024))
+AUDIO_MAX_CONCURRENT_UPLOADS = int(os.environ.get('AUDIO_MAX_CONCURRENT_UPLOADS', 8))
+AUDIO_UPLOAD_WAIT = float(os.environ.get('AUDIO_UPLOAD_WAIT', 5))  # seconds to wait for an upload slot
+AUDIO_SPOOL_DIR = os.environ.get('AUDIO_SPOOL_DIR') or tempfile.gettempdir()
+AUDIO_SPOOL_BLOCK_SIZE = 64 * 1024
+AUDIO_FORM_OVERHEAD = 64 * 1024  # multipart boundaries, part headers and the text_input field
+TRANSCRIPTION_TIMEOUT = float(os.environ.get('TRANSCRIPTION_TIMEOUT', 120))
+audio_upload_slots = threading.BoundedSemaphore(AUDIO_MAX_CONCURRENT_UPLOADS)
+transcription_executor = ThreadPoolExecutor(max_workers=int(os.environ.get('TRANSCRIPTION_WORKERS', 2)),
+                                            thread_name_prefix='transcription')
+
+class AudioTooLargeError(Exception):
+    """Raised when an upload exceeds AUDIO_MAX_UPLOAD_BYTES."""
+
+class AppRequest(Request):
+    """Request that caps /process_audio bodies, so Werkzeug never parses an oversized upload.
+    
+    Other routes keep MAX_CONTENT_LENGTH (unset), as imports stream large bodies.
+    """
+    
+    @property
+    def max_content_length(self):
+        if self.endpoint == 'process_audio':
+            return AUDIO_MAX_UPLOAD_BYTES + AUDIO_FORM_OVERHEAD
+        return super().max_content_length
+
+app.request_class = AppRequest
+
+class TranscriptionEngine(ABC):
+    """Interface for speech-to-text backends used by /process_audio."""
+    
+    name = 'base'
+    
+    @abstractmethod
+    def transcribe(self, audio_path, content_type=None):
+        """Return the transcription of the audio file at audio_path."""
+
+class StubTranscriptionEngine(TranscriptionEngine):
+    """Deterministic stand-in that describes the audio instead of transcribing it."""
+    
+    name = 'stub'
+    
+    def transcribe(self, audio_path, content_type=None):
+        digest = hashlib.sha256()
+        size = 0
+        with open(audio_path, 'rb') as audio:
+            for block in iter(lambda: audio.read(AUDIO_SPOOL_BLOCK_SIZE), b''):
+                digest.update(block)
+                size += len(block)
+        return f"stub transcription of {size} bytes of {content_type or 'audio'} {digest.hexdigest()[:12]}"
+
+TRANSCRIPTION_ENGINES = {
+    'stub': StubTranscriptionEngine
+}
+transcription_engine = None
+
+def get_transcription_engine():
+    """Return the engine named by TRANSCRIPTION_ENGINE, or None if server-side transcription is off.
+    
+    The name is either a key of TRANSCRIPTION_ENGINES or a "module:Class"
+    path to a TranscriptionEngine subclass.
+    """
+    global transcription_engine
+    engine_name = os.environ.get('TRANSCRIPTION_ENGINE', '').strip()
+    if not engine_name:
+        return None
+    if transcription_engine is None:
+        try:
+            if engine_name in TRANSCRIPTION_ENGINES:
+                engine_class = TRANSCRIPTION_ENGINES[engine_name]
+            else:
+                module_name, _, class_name = engine_name.partition(':')
+                engine_class = getattr(importlib.import_module(module_name), class_name)
+            if not (isinstance(engine_class, type) and issubclass(engine_class, TranscriptionEngine)):
+                raise TypeError(f"{engine_name} is not a TranscriptionEngine subclass")
+            # Instantiating raises TypeError if transcribe is not implemented
+            transcription_engine = engine_class()
+            logger.info(f"🎙️ Using transcription engine: {engine_name}")
+        except Exception as e:
+            logger.error(f"Error loading transcription engine {engine_name}: {str(e)}")
+            return None
+    return transcription_engine
+
+# Build the engine at startup so a misconfigured TRANSCRIPTION_ENGINE is reported immediately
+get_transcription_engine()
+
+def spool_audio(stream, max_bytes=None):
+    """Copy an audio stream to a temporary file in blocks and return (path, size)."""
+    max_bytes = AUDIO_MAX_UPLOAD_BYTES if max_bytes is None else max_bytes
+    handle, path = tempfile.mkstemp(prefix='audio-', dir=AUDIO_SPOOL_DIR)
+    size = 0
+    try:
+        with os.fdopen(handle, 'wb') as spool:
+            for block in iter(lambda: stream.read(AUDIO_SPOOL_BLOCK_SIZE), b''):
+                size += len(block)
+                if size > max_bytes:
+                    raise AudioTooLargeError(f"Audio upload exceeds {max_bytes} bytes")
+                spool.write(block)
+    except Exception:
+        os.unlink(path)
+        raise
+    return path, size
+
+def transcribe_audio_file(engine, audio_path, content_type=None, timeout=None):
+    """Transcribe a spooled file on the transcription pool and wait for the result."""
+    future = transcription_executor.submit(engine.transcribe, audio_path, content_type)
+    try:
+        return future.result(timeout=TRANSCRIPTION_TIMEOUT if timeout is None else timeout)
+    except FutureTimeoutError:
+        future.cancel()  # Drop it if it has not started; the caller removes the file
+        raise
 
 # Authentication routes
 @app.route('/login', methods=['GET', 'POST'])
@@ -663,8 +3203,7 @@ def login():
                 return render_template('login.html', error="Invalid email or password")
             
             response = make_response(redirect(url_for('dashboard')))
-            response.set_cookie('dentist_id', dentist_id, max_age=86400*30)  # 30 days
-            return response
+            return set_auth_cookie(response, dentist_id)
         else:
             return render_template('login.html', error="Database not available")
     
@@ -696,8 +3235,7 @@ def register():
             if save_dentist_to_kv(dentist_data):
                 redis_client.set(f"email_to_dentist:{email}", dentist_id)
                 response = make_response(redirect(url_for('dashboard')))
-                response.set_cookie('dentist_id', dentist_id, max_age=86400*30)  # 30 days
-                return response
+                return set_auth_cookie(response, dentist_id)
             else:
                 return render_template('register.html', error="Registration failed")
         else:
@@ -707,14 +3245,18 @@ def register():
 
 @app.route('/logout')
 def logout():
+    token = request.cookies.get(AUTH_COOKIE_NAME)
+    if token:
+        revoke_auth_token(token)
     response = make_response(redirect(url_for('login')))
-    response.delete_cookie('dentist_id')
+    response.delete_cookie(AUTH_COOKIE_NAME)
+    response.delete_cookie('dentist_id')  # Legacy unsigned cookie
     return response
 
 # Application routes
 @app.route('/')
 def home():
-    dentist_id = request.cookies.get('dentist_id')
+    dentist_id = get_current_dentist_id()
     if dentist_id and get_dentist_from_kv(dentist_id):
         return redirect(url_for('dashboard'))
     return render_template('index.html')
@@ -723,23 +3265,43 @@ def home():
 def health_check():
     return jsonify({"status": "ok"})
 
+@app.route('/api/metrics')
+@login_required
+def metrics():
+    return jsonify({
+        'dentist_cache': get_dentist_cache_stats(),
+        'redis_pool': get_redis_pool_stats()
+    })
+
+@app.route('/api/admin/model-routing')
+@admin_required
+def admin_model_routing():
+    health = get_model_health()
+    return jsonify({
+        'models': [dict(health[m['name']], name=m['name'], description=m['description']) for m in NOTE_MODELS],
+        'routing_order': [m['name'] for m in order_note_models(health=health, claim_probes=False)],
+        'breaker_threshold': MODEL_BREAKER_THRESHOLD,
+        'breaker_cooldown': MODEL_BREAKER_COOLDOWN
+    })
+
 @app.route('/dashboard')
 @login_required
 def dashboard():
-    dentist_id = request.cookies.get('dentist_id')
+    dentist_id = get_current_dentist_id()
     dentist = get_dentist_from_kv(dentist_id)
     
-    recent_patients = get_dentist_patients(dentist_id)[:5]  # Get 5 most recent patients
+    recent_patients, total_patients = get_recent_patients(dentist_id, 5)  # Get 5 most recent patients
     
     return render_template('dashboard.html', 
                           dentist=dentist,
-                          recent_patients=recent_patients)
+                          recent_patients=recent_patients,
+                          total_patients=total_patients)
 
 @app.route('/start-recording', methods=['POST', 'GET'])
 @login_required
 def start_recording():
     try:
-        dentist_id = request.cookies.get('dentist_id')
+        dentist_id = get_current_dentist_id()
         logger.info(f"Start recording accessed by dentist: {dentist_id}")
         
         if request.method == 'POST':
@@ -772,16 +3334,8 @@ def start_recording():
                     logger.warning(f"Invalid patient ID format: {new_patient_id} - {format_error}")
                     return redirect(url_for('start_recording', error=format_error))
                 
-                # Check if patient ID is unique across the entire system
-                if not is_patient_id_unique(new_patient_id):
-                    logger.warning(f"Patient ID {new_patient_id} already exists")
-                    return redirect(url_for('start_recording', error=f"Patient ID '{new_patient_id}' already exists. Please choose a different ID."))
-                
-                # Check if patient with same name already exists for this dentist
-                existing_patients = get_dentist_patients(dentist_id)
-                if any(p['name'].lower() == new_patient_name.lower() for p in existing_patients):
-                    logger.warning(f"Patient with name {new_patient_name} already exists")
-                    return redirect(url_for('start_recording', error=f"A patient named '{new_patient_name}' already exists. Please use a different name or select the existing patient."))
+                if not normalize_patient_name(new_patient_name):
+                    return redirect(url_for('start_recording', error="Please provide both patient name and ID for new patients"))
                 
                 # Use the provided patient ID
                 patient_id = new_patient_id
@@ -796,8 +3350,16 @@ def start_recording():
                     'notes_count': 0
                 }
                 
+                # Reserve the ID (unique across the system) and the name (unique per dentist) atomically
                 logger.info(f"Attempting to save patient: {patient_data}")
-                if not save_patient_to_kv(patient_data):
+                result = create_patient_in_kv(patient_data)
+                if result == 'id_taken':
+                    logger.warning(f"Patient ID {new_patient_id} already exists")
+                    return redirect(url_for('start_recording', error=f"Patient ID '{new_patient_id}' already exists. Please choose a different ID."))
+                if result == 'name_taken':
+                    logger.warning(f"Patient with name {new_patient_name} already exists")
+                    return redirect(url_for('start_recording', error=f"A patient named '{new_patient_name}' already exists. Please use a different name or select the existing patient."))
+                if result != 'created':
                     logger.error("Failed to save new patient to KV")
                     return redirect(url_for('start_recording', error="Failed to create new patient"))
                 logger.info(f"Successfully saved new patient with ID: {patient_id}")
@@ -848,7 +3410,7 @@ def start_recording():
 @app.route('/record/<patient_id>')
 @login_required
 def record(patient_id):
-    dentist_id = request.cookies.get('dentist_id')
+    dentist_id = get_current_dentist_id()
     patient = get_patient_from_kv(patient_id, dentist_id)
     
     if not patient:
@@ -859,7 +3421,7 @@ def record(patient_id):
 @app.route('/transcription/<patient_id>', methods=['GET', 'POST'])
 @login_required
 def transcription_page(patient_id):
-    dentist_id = request.cookies.get('dentist_id')
+    dentist_id = get_current_dentist_id()
     patient = get_patient_from_kv(patient_id, dentist_id)
     
     if not patient:
@@ -879,22 +3441,12 @@ def transcription_page(patient_id):
         logger.info(f"Processed transcription: {processed_transcription[:100]}...")
         
         # Store transcription in session
-        session_data = get_session()
-        session_data['pending_transcription'] = processed_transcription
-        session_data['pending_patient_id'] = patient_id
-        session_id, session_response = update_session(session_data)
+        update_session({'pending_transcription': processed_transcription, 'pending_patient_id': patient_id})
         logger.info(f"Stored transcription in session for patient {patient_id}")
         
         # Explicitly set show_loading=True in the redirect
         redirect_url = url_for('generate_clinical_record_route', patient_id=patient_id, show_loading=True)
         logger.info(f"Redirecting to: {redirect_url} with show_loading=True")
-        
-        # Create response with session cookie if needed
-        if session_response:
-            response = make_response(redirect(redirect_url))
-            response.set_cookie('session_id', session_id, max_age=86400, httponly=True)
-            return response
-        
         return redirect(redirect_url)
     
     logger.info(f"GET request for transcription page, patient: {patient_id}")
@@ -903,57 +3455,40 @@ def transcription_page(patient_id):
 @app.route('/patients')
 @login_required
 def patients_page():
-    dentist_id = request.cookies.get('dentist_id')
-    patients = get_dentist_patients(dentist_id)
+    dentist_id = get_current_dentist_id()
+    sort = request.args.get('sort') if request.args.get('sort') in PATIENT_SORTS else 'name'
+    patients, next_cursor = list_dentist_patients(dentist_id, sort, request.args.get('cursor'))
     
-    return render_template('patients.html', patients=patients)
+    return render_template('patients.html', patients=patients, sort=sort, next_cursor=next_cursor,
+                           is_first_page=not request.args.get('cursor'))
+
+@app.route('/api/patients')
+@login_required
+def api_list_patients():
+    sort = request.args.get('sort', 'name')
+    if sort not in PATIENT_SORTS:
+        return jsonify({'error': f"Unknown sort, expected one of: {', '.join(PATIENT_SORTS)}"}), 400
+    patients, next_cursor = list_dentist_patients(get_current_dentist_id(), sort, request.args.get('cursor'),
+                                                  page_size(request.args.get('limit')))
+    return jsonify({'patients': patients, 'sort': sort, 'next_cursor': next_cursor})
 
 @app.route('/search-patients')
 @login_required
 def search_patients():
-    dentist_id = request.cookies.get('dentist_id')
+    dentist_id = get_current_dentist_id()
     query = request.args.get('q', '').lower().strip()
     
     if not query: 
         return jsonify([])
     
-    patients = get_dentist_patients(dentist_id)
-    results = []
-    
-    for patient in patients:
-        # Search by name (partial match)
-        name_match = query in patient['name'].lower()
-        
-        # Search by patient ID (partial match from beginning or full match)
-        id_match = (query in patient['id'].lower() or 
-                   patient['id'].lower().startswith(query) or
-                   query in patient['id'][:8].lower())  # Search in short ID too
-        
-        if name_match or id_match:
-            # Add search relevance score
-            patient_result = patient.copy()
-            if patient['name'].lower().startswith(query):
-                patient_result['relevance'] = 3  # Exact name match
-            elif name_match:
-                patient_result['relevance'] = 2  # Partial name match
-            elif id_match:
-                patient_result['relevance'] = 1  # ID match
-            else:
-                patient_result['relevance'] = 0
-            
-            results.append(patient_result)
-    
-    # Sort by relevance (highest first)
-    results.sort(key=lambda x: x.get('relevance', 0), reverse=True)
-    
-    # Return top 10 results
-    return jsonify(results[:10])
+    # Return top 10 results, ranked by relevance (highest first)
+    return jsonify(search_dentist_patients(dentist_id, query, 10))
 
 @app.route('/save-note', methods=['POST'])
 @login_required
 def save_note():
     try:
-        dentist_id = request.cookies.get('dentist_id')
+        dentist_id = get_current_dentist_id()
         logger.info(f"Save note request from dentist: {dentist_id}")
         
         # Log the incoming data for debugging
@@ -1004,15 +3539,14 @@ def save_note():
         }
         
         logger.info(f"Attempting to save note with ID: {note_id}")
-        if not save_note_to_kv(note_data):
+        notes_count = save_note_to_kv(note_data)
+        if not notes_count:
             logger.error(f"Failed to save note {note_id} to Redis")
             return jsonify({'error': 'Failed to save note to database'}), 500
+        logger.info(f"Updated patient {patient_id} last visit and note count ({notes_count})")
         
-        # Update patient last visit
-        patient['last_visit'] = datetime.now().isoformat()
-        patient['notes_count'] = patient.get('notes_count', 0) + 1
-        save_patient_to_kv(patient)
-        logger.info(f"Updated patient {patient_id} last visit and note count")
+        # The generation job for this visit is finished with
+        get_session().pop(f"note_job:{patient_id}")
         
         logger.info(f"Successfully saved note {note_id} for patient {patient_id}")
         return jsonify({'success': True, 'note_id': note_id, 'patient_id': patient_id})
@@ -1025,22 +3559,31 @@ def save_note():
 @app.route('/patient/<patient_id>')
 @login_required
 def patient_notes_page(patient_id):
-    dentist_id = request.cookies.get('dentist_id')
+    dentist_id = get_current_dentist_id()
     patient = get_patient_from_kv(patient_id, dentist_id)
     
     if not patient:
         return redirect(url_for('patients_page'))
     
-    notes = get_patient_notes_from_kv(patient_id)
+    notes, next_cursor = list_patient_notes(patient_id, request.args.get('cursor'))
     patient_data = patient.copy()
     patient_data['notes'] = notes
     
-    return render_template('patient_notes.html', patient=patient_data)
+    return render_template('patient_notes.html', patient=patient_data, next_cursor=next_cursor,
+                           is_first_page=not request.args.get('cursor'))
+
+@app.route('/api/patients/<patient_id>/notes')
+@login_required
+def api_list_patient_notes(patient_id):
+    if not get_patient_from_kv(patient_id, get_current_dentist_id()):
+        return jsonify({'error': 'Patient not found'}), 404
+    notes, next_cursor = list_patient_notes(patient_id, request.args.get('cursor'), page_size(request.args.get('limit')))
+    return jsonify({'notes': notes, 'patient_id': patient_id, 'next_cursor': next_cursor})
 
 @app.route('/view-note/<note_id>')
 @login_required
 def view_note_page(note_id):
-    dentist_id = request.cookies.get('dentist_id')
+    dentist_id = get_current_dentist_id()
     note = get_note_from_kv(note_id)
     
     if not note or note.get('dentist_id') != dentist_id:
@@ -1059,7 +3602,7 @@ def view_note_page(note_id):
 @app.route('/generate-clinical-record/<patient_id>')
 @login_required
 def generate_clinical_record_route(patient_id):
-    dentist_id = request.cookies.get('dentist_id')
+    dentist_id = get_current_dentist_id()
     patient = get_patient_from_kv(patient_id, dentist_id)
     
     if not patient:
@@ -1073,14 +3616,23 @@ def generate_clinical_record_route(patient_id):
     if not transcription:
         transcription = request.args.get('transcription')
     
-    # Clear session data after retrieval
-    if transcription and session_data.get('pending_patient_id') == patient_id:
-        session_data.pop('pending_transcription', None)
-        session_data.pop('pending_patient_id', None)
-        session_id, session_response = update_session(session_data)
-        logger.info(f"Retrieved and cleared transcription from session for patient {patient_id}")
+    # One key per patient so tabs working on different patients never overwrite each other's jobs
+    job_key = f"note_job:{patient_id}"
+    job = None
+    if transcription:
+        # Start generation in the background and remember the job so a reload can resume it
+        job = submit_note_job(dentist_id, patient, transcription, use_cache=not wants_note_cache_bypass())
+        session_data[job_key] = job['id']
+        session_data.pop('pending_transcription')
+        session_data.pop('pending_patient_id')
+        logger.info(f"Retrieved transcription and queued note job {job['id']} for patient {patient_id}")
+    elif session_data.get(job_key):
+        job = get_note_job(session_data[job_key], dentist_id)
+        if job:
+            transcription = job['transcription']
+            logger.info(f"Resuming note job {job['id']} for patient {patient_id}")
     
-    if not transcription:
+    if not job:
         logger.warning(f"No transcription found for patient {patient_id}, redirecting back to transcription page")
         return redirect(url_for('transcription_page', patient_id=patient_id))
     
@@ -1088,23 +3640,81 @@ def generate_clinical_record_route(patient_id):
     show_loading = True
     logger.info(f"Showing loading screen for patient {patient_id} with transcription length: {len(transcription)}")
     
-    # Create response with session cookie if needed
-    response = make_response(render_template('clinicalrecord.html', 
-                                          patient=patient,
-                                          clinical_record="",
-                                          transcription=transcription,
-                                          show_loading=show_loading))
+    return render_template('clinicalrecord.html', 
+                           patient=patient,
+                           clinical_record="",
+                           transcription=transcription,
+                           note_job_id=job['id'],
+                           show_loading=show_loading)
+
+@app.route('/api/note-jobs', methods=['POST'])
+@login_required
+def api_submit_note_job():
+    dentist_id = get_current_dentist_id()
+    data = request.get_json(silent=True)
+    if not data:
+        return jsonify({'error': 'No JSON data provided'}), 400
     
-    if session_response:
-        response.set_cookie('session_id', session_id, max_age=86400, httponly=True)
+    patient_id = data.get('patient_id')
+    transcription = data.get('transcription')
+    if not patient_id:
+        return jsonify({'error': 'Missing patient_id'}), 400
+    if not transcription:
+        return jsonify({'error': 'Missing transcription'}), 400
     
-    return response
+    patient = get_patient_from_kv(patient_id, dentist_id)
+    if not patient:
+        logger.error(f"Invalid patient {patient_id} for dentist {dentist_id}")
+        return jsonify({'error': 'Invalid patient or permission denied'}), 403
+    
+    try:
+        job = submit_note_job(dentist_id, patient, transcription, use_cache=not wants_note_cache_bypass(data))
+    except Exception as e:
+        logger.error(f"Error submitting note job: {str(e)}")
+        return jsonify({'error': 'Could not queue note generation'}), 503
+    
+    response = note_job_response(job)
+    response['status_url'] = url_for('api_note_job_status', job_id=job['id'])
+    response['stream_url'] = url_for('api_note_job_stream', job_id=job['id'])
+    return jsonify(response), 202
+
+@app.route('/api/note-jobs/<job_id>')
+@login_required
+def api_note_job_status(job_id):
+    job = get_note_job(job_id, get_current_dentist_id())
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(note_job_response(job))
+
+@app.route('/api/note-jobs/<job_id>/stream')
+@login_required
+def api_note_job_stream(job_id):
+    """Stream a job's note over SSE as its runner generates it."""
+    dentist_id = get_current_dentist_id()
+    job = get_note_job(job_id, dentist_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    patient = get_patient_from_kv(job['patient_id'], dentist_id)
+    events = follow_note_job(job_id, dentist_id, patient.get('name', 'Patient') if patient else 'Patient',
+                             get_current_dentist_name())
+    
+    def generate():
+        try:
+            for event, event_data in events:
+                yield sse_event(event, event_data)
+        except Exception as e:
+            logger.error(f"Error while streaming note job {job_id}: {str(e)}")
+            logger.error(traceback.format_exc())
+            yield sse_event('error', {'error': f'Clinical note generation failed: {str(e)}'})
+    
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.route('/api/generate-note', methods=['POST'])
 @login_required
 def api_generate_note():
     try:
-        dentist_id = request.cookies.get('dentist_id')
+        dentist_id = get_current_dentist_id()
         if not dentist_id:
             logger.error("No dentist_id in cookies for generate-note request")
             return jsonify({'error': 'Authentication required'}), 401
@@ -1134,7 +3744,8 @@ def api_generate_note():
         logger.info(f"Generating clinical note for patient {patient_id} with transcription length: {len(transcription)}")
         
         try:
-            generated_clinical_record = generate_clinical_note(transcription, patient.get('name', 'Patient'))
+            generated_clinical_record = generate_clinical_note(transcription, patient.get('name', 'Patient'),
+                                                               use_cache=not wants_note_cache_bypass(data))
             
             if not generated_clinical_record:
                 logger.error("generate_clinical_note returned empty result")
@@ -1168,11 +3779,146 @@ def api_generate_note():
         logger.error(f"Full traceback: {traceback.format_exc()}")
         return jsonify({'error': f'Internal server error: {str(e)}'}), 500
 
+@app.route('/api/generate-note/stream', methods=['POST'])
+@login_required
+def api_generate_note_stream():
+    dentist_id = get_current_dentist_id()
+    data = request.get_json(silent=True)
+    if not data:
+        return jsonify({'error': 'No JSON data provided'}), 400
+    
+    patient_id = data.get('patient_id')
+    transcription = data.get('transcription')
+    if not patient_id:
+        return jsonify({'error': 'Missing patient_id'}), 400
+    if not transcription:
+        return jsonify({'error': 'Missing transcription'}), 400
+    
+    patient = get_patient_from_kv(patient_id, dentist_id)
+    if not patient:
+        logger.error(f"Invalid patient {patient_id} for dentist {dentist_id}")
+        return jsonify({'error': 'Invalid patient or permission denied'}), 403
+    
+    logger.info(f"Streaming clinical note for patient {patient_id} with transcription length: {len(transcription)}")
+    events = stream_clinical_note(transcription, patient.get('name', 'Patient'), get_current_dentist_name(),
+                                  use_cache=not wants_note_cache_bypass(data))
+    
+    def generate():
+        try:
+            for event, event_data in events:
+                yield sse_event(event, event_data)
+        except Exception as e:
+            logger.error(f"Error while streaming clinical note: {str(e)}")
+            logger.error(traceback.format_exc())
+            yield sse_event('error', {'error': f'Clinical note generation failed: {str(e)}'})
+    
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/process_audio', methods=['POST'])
+@login_required
+def process_audio():
+    """Transcribe uploaded audio.
+    
+    Accepts a multipart form with an `audio_data` file (and optional
+    `text_input` used when no audio is attached), or a raw audio body, which
+    may be sent with chunked transfer encoding.
+    """
+    if (request.content_length or 0) > AUDIO_MAX_UPLOAD_BYTES + AUDIO_FORM_OVERHEAD:
+        logger.warning(f"⚠️ Audio upload rejected: {request.content_length} bytes declared")
+        return jsonify({'error': f"Audio upload exceeds {AUDIO_MAX_UPLOAD_BYTES} bytes"}), 413
+    # Take a slot before reading the body so parsing is bounded too
+    if not audio_upload_slots.acquire(timeout=AUDIO_UPLOAD_WAIT):
+        logger.warning("⚠️ Audio upload rejected: all upload slots busy")
+        return jsonify({'error': 'Too many audio uploads in progress, please retry'}), 503, {'Retry-After': '5'}
+    audio_path = None
+    try:
+        audio = None
+        if request.mimetype in ('multipart/form-data', 'application/x-www-form-urlencoded'):
+            audio = request.files.get('audio_data')
+            if not (audio and audio.filename):
+                text = request.form.get('text_input', '').strip()
+                if not text:
+                    return jsonify({'error': 'No audio or text provided'}), 400
+                return jsonify({'success': True, 'transcription': process_speech_text(text), 'engine': None})
+        
+        engine = get_transcription_engine()
+        if not engine:
+            return jsonify({'error': 'Server-side transcription is not configured'}), 503
+        
+        content_type = audio.mimetype if audio else request.mimetype
+        audio_path, size = spool_audio(audio.stream if audio else request.stream)
+        if not size:
+            return jsonify({'error': 'Empty audio upload'}), 400
+        logger.info(f"🎙️ Transcribing {size} bytes of {content_type} with {engine.name}")
+        raw_text = transcribe_audio_file(engine, audio_path, content_type)
+        return jsonify({
+            'success': True,
+            'transcription': process_speech_text(raw_text) if raw_text.strip() else '',
+            'raw_transcription': raw_text,
+            'engine': engine.name,
+            'bytes': size
+        })
+    except AudioTooLargeError as e:
+        return jsonify({'error': str(e)}), 413
+    except RequestEntityTooLarge:
+        return jsonify({'error': f"Audio upload exceeds {AUDIO_MAX_UPLOAD_BYTES} bytes"}), 413
+    except FutureTimeoutError:
+        logger.error("Transcription timed out")
+        return jsonify({'error': 'Transcription timed out - please try again'}), 504
+    except Exception as e:
+        logger.error(f"Error processing audio: {str(e)}")
+        logger.error(traceback.format_exc())
+        return jsonify({'error': f'Audio transcription failed: {str(e)}'}), 500
+    finally:
+        if audio_path:
+            try:
+                os.unlink(audio_path)
+            except OSError as e:
+                logger.error(f"Error removing spooled audio {audio_path}: {str(e)}")
+        audio_upload_slots.release()
+
+@app.route('/api/import', methods=['POST'])
+@login_required
+def api_import_records():
+    """Import an NDJSON or CSV request body; pass ?job_id= to resume an interrupted import."""
+    fmt = transfer_format(request.args.get('format') or ('csv' if request.mimetype == 'text/csv' else None))
+    if not fmt:
+        return jsonify({'error': f"Unsupported format, expected one of: {', '.join(TRANSFER_FORMATS)}"}), 400
+    
+    # Chosen here so a failed import can still be resumed with the ID in the response
+    job_id = request.args.get('job_id') or str(uuid.uuid4())
+    lines = io.TextIOWrapper(request.stream, encoding='utf-8', newline='')
+    try:
+        summary = import_records(get_current_dentist_id(), iter_import_records(lines, fmt), job_id)
+    except UnicodeDecodeError:
+        return jsonify({'error': 'Import body must be UTF-8', 'job_id': job_id}), 400
+    except ValueError as e:
+        return jsonify({'error': str(e), 'job_id': job_id}), 403
+    except Exception as e:
+        logger.error(f"Error importing records (job {job_id}): {str(e)}")
+        logger.error(traceback.format_exc())
+        return jsonify({'error': f'Import failed: {str(e)}', 'job_id': job_id}), 500
+    return jsonify(summary)
+
+@app.route('/api/export')
+@login_required
+def api_export_records():
+    fmt = transfer_format(request.args.get('format'))
+    if not fmt:
+        return jsonify({'error': f"Unsupported format, expected one of: {', '.join(TRANSFER_FORMATS)}"}), 400
+    
+    records = iter_export_records(get_current_dentist_id())
+    filename = f"dental-notes-export-{datetime.now().strftime('%Y%m%d')}.{fmt}"
+    return Response(stream_with_context(format_export_records(records, fmt)),
+                    mimetype='text/csv' if fmt == 'csv' else 'application/x-ndjson',
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
 @app.route('/delete-patient/<patient_id>', methods=['DELETE'])
 @login_required
 def delete_patient_route(patient_id):
     try:
-        dentist_id = request.cookies.get('dentist_id')
+        dentist_id = get_current_dentist_id()
         if not dentist_id:
             logger.error("Delete patient request without dentist_id in cookies")
             return jsonify({'success': False, 'error': 'Authentication required'}), 401
@@ -1217,6 +3963,65 @@ def delete_patient_route(patient_id):
             'details': error_details
         }), 500
 
+# Maintenance commands
+@app.cli.command('reap-deleted-notes')
+def reap_deleted_notes_command():
+    """Delete notes still queued from removed patients."""
+    click.echo(f"Removed {reap_deleted_notes()} queued notes")
+
+@app.cli.command('check-orphan-notes')
+@click.option('--fix', is_flag=True, help='Unlink the orphaned notes that are found.')
+def check_orphan_notes_command(fix):
+    """Report note:* keys whose patient no longer exists or does not list them."""
+    summary = find_orphan_notes(fix=fix)
+    click.echo(f"Scanned {summary['scanned']} notes, found {len(summary['orphans'])} orphans")
+    for note_id in summary['orphans']:
+        click.echo(f"  note:{note_id}")
+    if fix:
+        click.echo(f"Removed {summary['removed']} orphaned notes")
+
+@app.cli.command('migrate-note-encoding')
+@click.option('--dry-run', is_flag=True, help='Report the savings without rewriting any notes.')
+def migrate_note_encoding_command(dry_run):
+    """Re-encode stored notes with the current RECORD_* codec settings."""
+    summary = migrate_note_encoding(dry_run=dry_run)
+    saved = summary['bytes_before'] - summary['bytes_after']
+    percent = saved / summary['bytes_before'] * 100 if summary['bytes_before'] else 0
+    action = 'Would rewrite' if dry_run else 'Rewrote'
+    click.echo(f"Scanned {summary['scanned']} notes. {action} {summary['migrated']}.")
+    click.echo(f"Size: {summary['bytes_before']} -> {summary['bytes_after']} bytes ({saved} bytes, {percent:.1f}% saved)")
+
+@app.cli.command('import-records')
+@click.argument('dentist_id')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(TRANSFER_FORMATS), help='Defaults to the file extension.')
+@click.option('--job-id', help='Resume the interrupted import with this ID.')
+def import_records_command(dentist_id, path, fmt, job_id):
+    """Import patients and notes for DENTIST_ID from an NDJSON or CSV file."""
+    if not get_dentist_from_kv(dentist_id):
+        raise click.ClickException(f"Unknown dentist {dentist_id}")
+    job_id = job_id or str(uuid.uuid4())
+    try:
+        with open(path, encoding='utf-8', newline='') as handle:
+            summary = import_records(dentist_id, iter_import_records(handle, transfer_format(fmt, path)), job_id)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    except Exception as e:
+        raise click.ClickException(f"Import failed: {str(e)}; resume it with --job-id {job_id}")
+    click.echo(f"Import {summary['job_id']}: {summary['patients']} patients, {summary['notes']} notes, "
+               f"{summary['skipped']} skipped, {summary['failed']} failed")
+    for error in summary['errors']:
+        click.echo(f"  line {error['line']}: {error['error']}")
+
+@app.cli.command('export-records')
+@click.argument('dentist_id')
+@click.option('--format', 'fmt', type=click.Choice(TRANSFER_FORMATS), default='ndjson')
+@click.option('--output', type=click.File('w', encoding='utf-8'), default='-', help='Defaults to stdout.')
+def export_records_command(dentist_id, fmt, output):
+    """Export DENTIST_ID's patients and notes as NDJSON or CSV."""
+    for chunk in format_export_records(iter_export_records(dentist_id), fmt):
+        output.write(chunk)
+
 # Test route for Redis connection
 @app.route('/api/redis-test')
 def redis_test():
@@ -0,0 +1,99 @@
+"""Benchmark bulk import throughput.
+
+Generates a synthetic NDJSON import (patients, each followed by its notes)
+for a throwaway dentist, imports it with import_records and reports records
+per minute for each batch size, then exports it again. Runs against the
+Redis at REDIS_URL; every key the run creates is under a random dentist ID
+and is deleted afterwards unless --keep is given. --fakeredis runs against
+an in-process fakeredis instead, which measures the Python side only.
+
+    REDIS_URL=redis://localhost:6379 python bench/bench_import.py --patients 2000 --notes 5
+    python bench/bench_import.py --fakeredis --batch-sizes 100 500 1000
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import uuid
+
+CONTENT = ("CHIEF COMPLAINT\nSensitivity to cold on #14.\n\nCLINICAL FINDINGS\nMesial occlusal caries #3.\n\n"
+           "TREATMENT PROVIDED\nComposite restoration #19 under local anaesthetic.\n\nFOLLOW-UP\n6 weeks.")
+
+
+def synthetic_import(patients, notes):
+    """Yield (line number, record) pairs as iter_import_records would for an NDJSON file."""
+    line_number = 0
+    for p in range(patients):
+        line_number += 1
+        patient_id = f"BENCH-{p:06d}"
+        yield line_number, {'type': 'patient', 'id': patient_id, 'name': f"Bench Patient {p:06d}",
+                            'created_at': '2024-01-01T09:00:00', 'last_visit': '2024-01-01T09:00:00'}
+        for n in range(notes):
+            line_number += 1
+            yield line_number, {'type': 'note', 'patient_id': patient_id, 'content': CONTENT,
+                                'timestamp': f"2024-{n % 12 + 1:02d}-01T09:00:00"}
+
+
+def delete_dentist_keys(client, dentist_id):
+    patient_ids = [pid.decode() for pid in client.smembers(f"dentist:{dentist_id}:patients")]
+    keys = [f"dentist:{dentist_id}"]
+    for patient_id in patient_ids:
+        note_ids = [nid.decode() for nid in client.smembers(f"patient:{patient_id}:notes")]
+        keys += [f"note:{nid}" for nid in note_ids] + [f"note_summary:{nid}" for nid in note_ids]
+        keys += [f"patient:{patient_id}", f"patient:{patient_id}:notes", f"patient:{patient_id}:notes:by_time"]
+    keys += [key.decode() for key in client.scan_iter(f"dentist:{dentist_id}:*", count=1000)]
+    for i in range(0, len(keys), 1000):
+        client.delete(*keys[i:i + 1000])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--patients', type=int, default=1000)
+    parser.add_argument('--notes', type=int, default=5, help='notes per patient')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[500], help='IMPORT_BATCH_SIZE values to compare')
+    parser.add_argument('--fakeredis', action='store_true', help='use an in-process fakeredis instead of REDIS_URL')
+    parser.add_argument('--keep', action='store_true', help='leave the imported data in Redis')
+    args = parser.parse_args()
+
+    os.environ.setdefault('SECRET_KEY', 'bench')
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'api'))
+    import logging
+    import index
+    logging.disable(logging.CRITICAL)
+    if args.fakeredis:
+        import fakeredis
+        index.redis_client = fakeredis.FakeRedis()
+    if not index.redis_client:
+        sys.exit("Set REDIS_URL or pass --fakeredis")
+    client = index.redis_client
+
+    total = args.patients * (args.notes + 1)
+    print(f"{args.patients} patients x {args.notes} notes = {total} records "
+          f"({'fakeredis' if args.fakeredis else 'REDIS_URL'})")
+    print(f"{'batch':>6} {'import':>8} {'records/min':>12} {'export':>8} {'records/min':>12}")
+    for batch_size in args.batch_sizes:
+        dentist_id = f"bench-{uuid.uuid4().hex[:12]}"
+        job_id = f"{dentist_id}-import"
+        client.set(f"dentist:{dentist_id}", json.dumps({'id': dentist_id, 'name': 'Dr Bench'}))
+        try:
+            started = time.monotonic()
+            summary = index.import_records(dentist_id, synthetic_import(args.patients, args.notes),
+                                           job_id=job_id, batch_size=batch_size)
+            import_time = time.monotonic() - started
+            if summary['failed'] or summary['patients'] + summary['notes'] != total:
+                print(f"unexpected summary: {summary}")
+
+            started = time.monotonic()
+            exported = sum(1 for _ in index.format_export_records(index.iter_export_records(dentist_id), 'ndjson'))
+            export_time = time.monotonic() - started
+            print(f"{batch_size:>6} {import_time:>7.2f}s {total / import_time * 60:>12,.0f} "
+                  f"{export_time:>7.2f}s {exported / export_time * 60:>12,.0f}")
+        finally:
+            if not args.keep:
+                client.delete(f"import:{job_id}")
+                delete_dentist_keys(client, dentist_id)
+
+
+if __name__ == '__main__':
+    main()
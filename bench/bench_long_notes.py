@@ -0,0 +1,151 @@
+"""Benchmark note generation for long dictations against a local model stub.
+
+Starts a stub OpenRouter endpoint on localhost, then generates notes for
+synthetic dictations of increasing length and reports wall time, model
+calls, peak concurrent model calls and whether the fallback note was used.
+Nothing leaves the machine; REDIS_URL is optional (without it rate limits,
+breakers and the note cache are skipped).
+
+    python bench/bench_long_notes.py --lengths 4000 20000 60000 --latency 0.5
+    python bench/bench_long_notes.py --hang --deadline 10   # models never answer
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PHRASES = [
+    "the patient reports sensitivity to cold on tooth 14",
+    "um there is a mesial occlusal cavity on 3 and and distal decay on 30",
+    "probing depths of 4 to 5 millimetres noted in the lower left quadrant",
+    "however the patient denies any swelling or fever",
+    "we placed a composite restoration on 19 under local anaesthetic",
+    "uh prescribed amoxicillin 500 mg three times daily for seven days",
+    "radiographs show periapical radiolucency on tooth 8",
+    "scaling and root planing performed in quadrants 1 and 2",
+    "patient advised to floss daily and use fluoride toothpaste",
+    "follow up in six weeks to review healing",
+]
+
+NOTE = ("DENTAL CLINICAL NOTE\n\nCHIEF COMPLAINT\nSensitivity on #14.\n\nCLINICAL FINDINGS\nCaries #3, #30.\n\n"
+        "TREATMENT PROVIDED\nComposite #19.\n\nMEDICATIONS\nAmoxicillin 500 mg TID x 7 days.\n\n"
+        "FOLLOW-UP\n6 weeks.\n\nNote: Please verify all information.")
+
+
+class StubModelHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    latency = 0.5
+    hang = False
+    lock = threading.Lock()
+    calls = 0
+    active = 0
+    peak = 0
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        cls = type(self)
+        with cls.lock:
+            cls.calls += 1
+            cls.active += 1
+            cls.peak = max(cls.peak, cls.active)
+        try:
+            time.sleep(3600 if cls.hang else cls.latency)
+            if body.get('stream'):
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+                for i in range(0, len(NOTE), 40):
+                    event = 'data: ' + json.dumps({'choices': [{'delta': {'content': NOTE[i:i + 40]}}]}) + '\n\n'
+                    self._chunk(event)
+                self._chunk('data: [DONE]\n\n')
+                self.wfile.write(b'0\r\n\r\n')
+            else:
+                payload = json.dumps({'choices': [{'message': {'content': NOTE}}]}).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            with cls.lock:
+                cls.active -= 1
+
+    def _chunk(self, text):
+        data = text.encode()
+        self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+        self.wfile.flush()
+
+
+def synthetic_dictation(length, seed):
+    rng = random.Random(seed)
+    words = []
+    size = 0
+    while size < length:
+        phrase = rng.choice(PHRASES)
+        words.append(phrase)
+        size += len(phrase) + 2
+    return '. '.join(words)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--lengths', type=int, nargs='+', default=[4000, 20000, 60000],
+                        help='dictation lengths in characters')
+    parser.add_argument('--latency', type=float, default=0.5, help='seconds the stub takes per model call')
+    parser.add_argument('--hang', action='store_true', help='the stub never answers (deadline behaviour)')
+    parser.add_argument('--deadline', type=float, help='override NOTE_DEADLINE_SECONDS')
+    parser.add_argument('--port', type=int, default=8799)
+    args = parser.parse_args()
+
+    StubModelHandler.latency = args.latency
+    StubModelHandler.hang = args.hang
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), StubModelHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    os.environ['OPENROUTER_API_URL'] = f'http://127.0.0.1:{args.port}/v1/chat/completions'
+    os.environ.setdefault('OPENROUTER_API_KEY', 'bench')
+    if args.deadline:
+        os.environ['NOTE_DEADLINE_SECONDS'] = str(args.deadline)
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'api'))
+    import logging
+    import index
+    logging.disable(logging.CRITICAL)
+
+    print(f"deadline {index.NOTE_DEADLINE_SECONDS:.0f}s, stub latency "
+          f"{'hang' if args.hang else f'{args.latency}s'}, segment threshold {index.NOTE_SEGMENT_THRESHOLD} chars, "
+          f"{index.NOTE_EXTRACT_CONCURRENCY} segments in flight per note")
+    print(f"{'chars':>7} {'segments':>8} {'first event':>11} {'first text':>10} {'total':>7} "
+          f"{'calls':>5} {'peak':>4} {'fallback':>8}")
+    for seed, length in enumerate(args.lengths):
+        text = synthetic_dictation(length, seed)
+        segments = len(index.split_transcription_segments(text)) if len(text) > index.NOTE_SEGMENT_THRESHOLD else 1
+        StubModelHandler.calls = StubModelHandler.peak = 0
+        started = time.monotonic()
+        first_event = first_text = None
+        fallback = None
+        for event, data in index.stream_clinical_note(text, 'Bench Patient', 'Dr Bench', use_cache=False):
+            now = time.monotonic() - started
+            first_event = now if first_event is None else first_event
+            if event == 'delta' and first_text is None:
+                first_text = now
+            if event == 'done':
+                fallback = data['fallback']
+        total = time.monotonic() - started
+        print(f"{len(text):>7} {segments:>8} {first_event:>10.2f}s {first_text:>9.2f}s {total:>6.2f}s "
+              f"{StubModelHandler.calls:>5} {StubModelHandler.peak:>4} {str(fallback):>8}")
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
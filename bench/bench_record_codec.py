@@ -0,0 +1,164 @@
+"""Benchmark the stored record codec on representative notes and patients.
+
+Builds synthetic note records (a formatted clinical note plus the dictation
+it came from) at several dictation lengths, and patient records, then
+encodes each with every codec available here: JSON and msgpack (if the
+package is installed), each with and without zlib. Reports the average
+stored size against the legacy plain-JSON value, the saving, and encode
+and decode times. Patients are shown for comparison only; they stay plain
+JSON in Redis because Lua scripts decode them. Nothing touches Redis.
+
+    python bench/bench_record_codec.py
+    python bench/bench_record_codec.py --lengths 500 2000 8000 --samples 200
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import uuid
+
+# Dictation phrases with slots filled at random, plus free-form clauses built
+# from VOCABULARY, so samples do not compress better than real dictation
+PHRASES = [
+    "the patient reports sensitivity to {temp} on tooth {tooth}",
+    "um there is a {surface} cavity on {tooth} and and {surface} decay on {tooth}",
+    "probing depths of {mm} to {mm2} millimetres noted in the {quadrant} quadrant",
+    "however the patient denies any {symptom} or {symptom}",
+    "we placed a {material} restoration on {tooth} under local anaesthetic",
+    "uh prescribed {drug} {dose} mg {frequency} for {days} days",
+    "radiographs show {finding} on tooth {tooth}",
+    "scaling and root planing performed in quadrants {q} and {q2}",
+    "patient advised to {advice}",
+    "follow up in {weeks} weeks to review {review}",
+]
+SLOTS = {
+    'temp': ['cold', 'heat', 'sweets', 'pressure'],
+    'surface': ['mesial', 'distal', 'occlusal', 'buccal', 'lingual', 'mesial occlusal', 'disto occlusal'],
+    'quadrant': ['upper left', 'upper right', 'lower left', 'lower right'],
+    'symptom': ['swelling', 'fever', 'bleeding', 'numbness', 'throbbing', 'bad taste'],
+    'material': ['composite', 'amalgam', 'glass ionomer', 'temporary'],
+    'drug': ['amoxicillin', 'ibuprofen', 'clindamycin', 'metronidazole', 'chlorhexidine rinse'],
+    'frequency': ['twice daily', 'three times daily', 'every six hours'],
+    'finding': ['periapical radiolucency', 'bone loss', 'an open contact', 'recurrent decay', 'a calculus bridge'],
+    'advice': ['floss daily', 'use fluoride toothpaste', 'avoid hard foods', 'rinse with warm salt water'],
+    'review': ['healing', 'the restoration', 'pocket depths', 'sensitivity'],
+}
+VOCABULARY = ("patient mentioned that the area around it has been bothering them since last month when "
+              "eating on that side and they also noticed some gum recession near the front lower teeth "
+              "which we discussed along with options for a night guard given signs of bruxism wear facets "
+              "on the canines and premolars plus mild staining from coffee so we polished everything").split()
+
+NOTE_SECTIONS = [
+    ("CHIEF COMPLAINT", ["Sensitivity to cold on #14.", "Intermittent pain in the lower left quadrant."]),
+    ("CLINICAL FINDINGS", ["Mesial occlusal caries #3.", "Distal decay #30.", "Probing depths 4-5 mm lower left.",
+                           "Periapical radiolucency #8 on radiograph."]),
+    ("TREATMENT PROVIDED", ["Composite restoration #19 under local anaesthetic.",
+                            "Scaling and root planing, quadrants 1 and 2."]),
+    ("MEDICATIONS", ["Amoxicillin 500 mg TID x 7 days.", "None documented"]),
+    ("FOLLOW-UP", ["Review healing in 6 weeks.", "Recall in 6 months."]),
+]
+
+
+def synthetic_phrase(rng):
+    if rng.random() < 0.3:
+        return ' '.join(rng.sample(VOCABULARY, rng.randrange(6, 16)))
+    values = {slot: rng.choice(options) for slot, options in SLOTS.items()}
+    values.update(tooth=rng.randrange(1, 33), mm=rng.randrange(2, 6), mm2=rng.randrange(4, 9),
+                  dose=rng.choice([250, 400, 500, 600]), days=rng.randrange(3, 11),
+                  q=rng.randrange(1, 5), q2=rng.randrange(1, 5), weeks=rng.randrange(1, 13))
+    return rng.choice(PHRASES).format(**values)
+
+
+def synthetic_dictation(length, rng):
+    phrases = []
+    size = 0
+    while size < length:
+        phrase = synthetic_phrase(rng)
+        phrases.append(phrase)
+        size += len(phrase) + 2
+    return '. '.join(phrases)
+
+
+def synthetic_note(length, rng):
+    lines = ["DENTAL CLINICAL NOTE", "Date: January 15, 2025", "Time: 10:30 AM",
+             f"Patient Name: Patient {rng.randrange(10000):04d}", "Dentist Name: Dr Bench", "", "CLINICAL NOTES:"]
+    for heading, findings in NOTE_SECTIONS:
+        # Longer dictations document more in each section
+        count = max(1, min(len(findings), length // 1500 + 1))
+        lines += [heading] + rng.sample(findings, count) + [""]
+    lines.append("Note: Please verify all information above.")
+    return {
+        'id': str(uuid.UUID(int=rng.getrandbits(128))),
+        'content': '\n'.join(lines),
+        'transcription': synthetic_dictation(length, rng),
+        'timestamp': f"2025-01-{rng.randrange(1, 29):02d}T10:30:00",
+        'patient_id': f"P{rng.randrange(100000):05d}",
+        'dentist_id': str(uuid.UUID(int=rng.getrandbits(128))),
+        'patient_name': f"Patient {rng.randrange(10000):04d}"
+    }
+
+
+def synthetic_patient(rng):
+    return {
+        'id': f"P{rng.randrange(100000):05d}",
+        'name': f"{rng.choice(['Alice', 'Bob', 'Carol', 'Dev', 'Eun'])} {rng.choice(['Smith', 'Okafor', 'Nguyen'])}",
+        'dentist_id': str(uuid.UUID(int=rng.getrandbits(128))),
+        'created_at': '2024-06-01T09:00:00',
+        'last_visit': f"2025-01-{rng.randrange(1, 29):02d}T10:30:00",
+        'notes_count': rng.randrange(40)
+    }
+
+
+def measure(index, records, serializer, compress_threshold):
+    encoded = []
+    started = time.perf_counter()
+    for record in records:
+        encoded.append(index.encode_record(record, serializer, compress_threshold))
+    encode_time = time.perf_counter() - started
+    started = time.perf_counter()
+    for value in encoded:
+        index.decode_record(value)
+    decode_time = time.perf_counter() - started
+    return sum(map(len, encoded)), encode_time, decode_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--lengths', type=int, nargs='+', default=[500, 2000, 8000, 30000],
+                        help='dictation lengths in characters')
+    parser.add_argument('--samples', type=int, default=100, help='records per group')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    os.environ.setdefault('SECRET_KEY', 'bench')
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'api'))
+    import logging
+    import index
+    logging.disable(logging.CRITICAL)
+
+    rng = random.Random(args.seed)
+    groups = [(f"notes, {length} char dictation", [synthetic_note(length, rng) for _ in range(args.samples)])
+              for length in args.lengths]
+    groups.append(("patients (stored as plain JSON)", [synthetic_patient(rng) for _ in range(args.samples)]))
+    codecs = [(f"{serializer}{'+zlib' if compress else ''}", serializer,
+               index.RECORD_COMPRESS_THRESHOLD if compress else -1)
+              for serializer in index.record_serializers for compress in (False, True)]
+
+    print(f"{args.samples} records per group; zlib applies from {index.RECORD_COMPRESS_THRESHOLD} bytes; "
+          f"serializers: {', '.join(index.record_serializers)}"
+          f"{'' if 'msgpack' in index.record_serializers else ' (pip install msgpack to compare it)'}")
+    print(f"{'records':<32} {'codec':<13} {'avg bytes':>9} {'ratio':>6} {'saved':>6} {'encode':>9} {'decode':>9}")
+    for label, records in groups:
+        # The legacy value: json.dumps with default separators, no header
+        raw = sum(len(json.dumps(record).encode('utf-8')) for record in records)
+        print(f"{label:<32} {'legacy json':<13} {raw / len(records):>9.0f} {1:>6.2f} {0:>5.0%}")
+        for name, serializer, threshold in codecs:
+            size, encode_time, decode_time = measure(index, records, serializer, threshold)
+            print(f"{'':<32} {name:<13} {size / len(records):>9.0f} {size / raw:>6.2f} {1 - size / raw:>5.0%} "
+                  f"{encode_time / len(records) * 1e6:>7.1f}us {decode_time / len(records) * 1e6:>7.1f}us")
+
+
+if __name__ == '__main__':
+    main()
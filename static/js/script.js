@@ -29,11 +29,11 @@ document.addEventListener('DOMContentLoaded', () => {
                     body: formData
                 });
 
+                const data = await response.json();
                 if (response.ok) {
-                    const resultText = await response.text();
-                    formattedNoteOutput.textContent = resultText;
+                    formattedNoteOutput.textContent = data.transcription;
                 } else {
-                    formattedNoteOutput.textContent = `Error: ${response.status} ${await response.text()}`;
+                    formattedNoteOutput.textContent = `Error: ${response.status} ${data.error || 'Could not process audio.'}`;
                 }
             } catch (error) {
                 console.error('Error submitting form:', error);
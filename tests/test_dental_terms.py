@@ -0,0 +1,39 @@
+"""Golden-output tests for tooth-number extraction.
+
+tests/golden/tooth_numbers.json holds dictation snippets with the tooth
+numbers the fallback note must pick up from them, in order of mention.
+Extraction runs on the processed dictation, which adds punctuation around
+lists, so every case is checked on both the raw and the processed text.
+"""
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'api'))
+
+import index  # noqa: E402
+
+GOLDEN_PATH = os.path.join(os.path.dirname(__file__), 'golden', 'tooth_numbers.json')
+
+with open(GOLDEN_PATH, encoding='utf-8') as golden_file:
+    GOLDEN_CASES = json.load(golden_file)
+
+
+@pytest.mark.parametrize('case', GOLDEN_CASES, ids=lambda case: repr(case['input'][:40]))
+def test_extract_tooth_numbers_matches_golden_output(case):
+    for text in (case['input'], index.process_speech_text(case['input'])):
+        assert [match.term for match in index.extract_tooth_numbers(text)] == case['expected']
+
+
+@pytest.mark.parametrize('case', GOLDEN_CASES, ids=lambda case: repr(case['input'][:40]))
+def test_every_tooth_number_span_ends_at_its_number(case):
+    for match in index.extract_tooth_numbers(case['input']):
+        assert case['input'][match.start:match.end].endswith(match.term)
+
+
+def test_fallback_note_groups_every_tooth_in_a_list():
+    grouped = index.group_dental_terms(index.extract_dental_terms(
+        index.process_speech_text("fillings on teeth 3, 14 and 30 and a cleaning")))
+    assert grouped['teeth'] == ['3', '14', '30']
@@ -0,0 +1,98 @@
+"""Indexed patient search must return what a full tiered scan would.
+
+The reference ranks every patient of the dentist by patient_search_relevance
+(3 name prefix, 2 name substring, 1 ID substring) the way search did before
+the posting index existed. Practices here hold hundreds of overlapping names,
+so matches sit far beyond the first few hundred postings of a tier.
+"""
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'api'))
+
+import index  # noqa: E402
+
+fakeredis = pytest.importorskip('fakeredis')
+
+DENTIST_ID = 'dentist-search'
+
+
+@pytest.fixture
+def redis_client(monkeypatch):
+    client = fakeredis.FakeRedis()
+    monkeypatch.setattr(index, 'redis_client', client)
+    return client
+
+
+def add_patients(client, names):
+    """Store and index patients in order, so later names sit late in every posting."""
+    patients = []
+    for number, name in enumerate(names):
+        patient = {'id': f"P{number:04d}", 'name': name, 'dentist_id': DENTIST_ID,
+                   'created_at': '2024-01-01T09:00:00', 'last_visit': '2024-01-01T09:00:00', 'notes_count': 0}
+        client.set(f"patient:{patient['id']}", json.dumps(patient))
+        client.sadd(f"dentist:{DENTIST_ID}:patients", patient['id'])
+        index.index_patient_for_search(patient)
+        patients.append(patient)
+    return patients
+
+
+def assert_matches_full_scan(patients, query, limit):
+    results = index.search_dentist_patients(DENTIST_ID, query.lower(), limit)
+    ranked = sorted((index.patient_search_relevance(p, query.lower()), p['id']) for p in patients)
+    ranked = [(relevance, pid) for relevance, pid in reversed(ranked) if relevance]
+    expected = ranked[:limit]
+
+    assert [r['relevance'] for r in results] == [relevance for relevance, _ in expected]
+    assert len({r['id'] for r in results}) == len(results)
+    # Tiers that fit entirely must match exactly; the last one may be any of its matches
+    for relevance in {relevance for relevance, _ in expected}:
+        found = {r['id'] for r in results if r['relevance'] == relevance}
+        tier = {pid for rel, pid in ranked if rel == relevance}
+        if len(tier) <= limit - sum(1 for rel, _ in expected if rel > relevance):
+            assert found == tier
+        else:
+            assert found <= tier
+    return results
+
+
+def test_long_query_finds_matches_behind_hundreds_of_false_candidates(redis_client):
+    # Every n-gram of "anna" is shared by 250 names; only the last five contain it
+    names = [f"Joann Lee {i}" for i in range(250)] + [f"Jonna Lee {i}" for i in range(250)]
+    patients = add_patients(redis_client, names + [f"Xanna Lee {i}" for i in range(5)])
+
+    results = assert_matches_full_scan(patients, 'anna', 10)
+
+    assert sorted(r['name'] for r in results) == [f"Xanna Lee {i}" for i in range(5)]
+
+
+def test_short_query_reaches_substring_tier_after_hundreds_of_prefix_matches(redis_client):
+    names = [f"Ann Patient {i}" for i in range(230)] + [f"Joanne Patient {i}" for i in range(230)]
+    patients = add_patients(redis_client, names + ["Brian Lee", "Stan Ko"])
+
+    results = assert_matches_full_scan(patients, 'an', 300)
+
+    assert sum(r['relevance'] == 3 for r in results) == 230
+    assert sum(r['relevance'] == 2 for r in results) == 70
+
+
+def test_every_match_is_returned_when_the_limit_allows(redis_client):
+    names = [f"Ann Patient {i}" for i in range(210)] + [f"Joanne Patient {i}" for i in range(210)]
+    patients = add_patients(redis_client, names + ["Brian Lee", "Stan Ko", "Nobody"])
+
+    results = assert_matches_full_scan(patients, 'an', 1000)
+
+    assert len(results) == 422
+
+
+def test_id_tier_is_reached_past_name_matches(redis_client):
+    # IDs P0000-P0099 match "p00" only by ID; the 250 names after them all contain it
+    names = [f"Other {i}" for i in range(100)] + [f"Ward P00 {i}" for i in range(250)]
+    patients = add_patients(redis_client, names)
+
+    results = assert_matches_full_scan(patients, 'p00', 300)
+
+    assert [r['relevance'] for r in results].count(1) == 50
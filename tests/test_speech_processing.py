@@ -0,0 +1,41 @@
+"""Golden-output tests for the dictation normaliser.
+
+tests/golden/speech_processing.json holds inputs with the output the
+original single-pass process_speech_text produced for them. The streaming
+pipeline must reproduce it exactly, whether the text arrives whole or in
+arbitrary chunks.
+"""
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'api'))
+
+import index  # noqa: E402
+
+GOLDEN_PATH = os.path.join(os.path.dirname(__file__), 'golden', 'speech_processing.json')
+
+with open(GOLDEN_PATH, encoding='utf-8') as golden_file:
+    GOLDEN_CASES = json.load(golden_file)
+
+WHOLE_CASES = [case for case in GOLDEN_CASES if 'input' in case]
+CHUNKED_CASES = [case for case in GOLDEN_CASES if 'chunks' in case]
+
+
+@pytest.mark.parametrize('case', WHOLE_CASES, ids=lambda case: repr(case['input'][:40]))
+def test_process_speech_text_matches_golden_output(case):
+    assert index.process_speech_text(case['input']) == case['expected']
+
+
+@pytest.mark.parametrize('case', CHUNKED_CASES, ids=lambda case: repr(''.join(case['chunks'])[:40]))
+def test_iter_processed_speech_matches_golden_output_across_chunk_splits(case):
+    assert ''.join(index.iter_processed_speech(case['chunks'])) == case['expected']
+
+
+@pytest.mark.parametrize('case', WHOLE_CASES, ids=lambda case: repr(case['input'][:40]))
+def test_every_split_point_gives_the_same_output(case):
+    text = case['input']
+    for cut in range(len(text) + 1):
+        assert ''.join(index.iter_processed_speech([text[:cut], text[cut:]])) == case['expected']